@@ -5,6 +5,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import json
 import os
+import shutil
 import re
 import requests
 from typing import Dict, List, Optional, Any
@@ -17,10 +18,15 @@ import pandas as pd
 import akshare as ak
 from datetime import datetime, timedelta
 from tqdm import tqdm
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment
 from bs4 import BeautifulSoup
 
+from curve_store import (CURVE_MAX_DAYS, CURVE_POINTS, compute_excess_curves, save_curve_store, iter_curves,
+                         lttb_indices, stride_indices)
+from excel_format import EXCEL_ENGINE, compute_column_widths, set_column_widths
+from jiuquaner_fund_style import strip_share_class_suffix
+from rank_warehouse import fetch_rank_table
+from trading_calendar import is_quarterly_data_stale
+
 HEADER_JIUQUAN = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Content-Type': 'application/json',
@@ -231,7 +237,7 @@ def get_csi_all_share_history(days=365):
         return None
 
 
-def calculate_excess_return_curve(fund_df, benchmark_df):
+def calculate_excess_return_curve(fund_df, benchmark_df, points=CURVE_POINTS):
     """
     计算基金相对基准的超额收益曲线
 
@@ -241,6 +247,8 @@ def calculate_excess_return_curve(fund_df, benchmark_df):
         基金净值数据，包含日期和累计净值列
     benchmark_df : pd.DataFrame
         基准指数数据，包含日期和指数列
+    points : int or None
+        返回的数据点数（LTTB降采样，保留峰值和谷值），默认60；为None时返回全部数据点
 
     返回
     ------
@@ -272,14 +280,10 @@ def calculate_excess_return_curve(fund_df, benchmark_df):
         merged['基准收益'] = merged['指数'] / merged['指数'].iloc[0] - 1
         merged['超额收益'] = merged['基金收益'] - merged['基准收益']
         
-        # 格式化数据，减少数据点到约60个点（避免数据过多）
-        if len(merged) > 60:
-            step = max(1, len(merged) // 60)
-            # 确保包含第一天和最后一天
-            indices = list(range(0, len(merged), step))
-            if indices[-1] != len(merged) - 1:
-                indices.append(len(merged) - 1)
-            merged = merged.iloc[indices].reset_index(drop=True)
+        # 降采样到points个点（避免数据过多），包含第一天和最后一天
+        if points is not None:
+            day_numbers = merged['日期'].to_numpy().astype('datetime64[D]').astype(np.int64)
+            merged = merged.iloc[lttb_indices(merged['超额收益'].to_numpy(), points, x=day_numbers)].reset_index(drop=True)
         
         # 最后再检查一次排序（确保日期是升序）
         merged = merged.sort_values('日期').reset_index(drop=True)
@@ -305,7 +309,7 @@ def calculate_excess_return_curve(fund_df, benchmark_df):
         return None
 
 
-def get_excess_return_curve_for_fund(fund_code, days=365, benchmark_df=None):
+def get_excess_return_curve_for_fund(fund_code, days=365, benchmark_df=None, points=CURVE_POINTS):
     """
     一站式获取基金相对中证全指的超额收益曲线
 
@@ -317,6 +321,8 @@ def get_excess_return_curve_for_fund(fund_code, days=365, benchmark_df=None):
         天数，默认365天
     benchmark_df : pd.DataFrame, optional
         预先获取的中证全指数据，如果提供则不再重复获取
+    points : int or None
+        返回的数据点数，默认60；为None时返回全部数据点
 
     返回
     ------
@@ -342,7 +348,7 @@ def get_excess_return_curve_for_fund(fund_code, days=365, benchmark_df=None):
         else:
             print(f"  ✓ 使用预先获取的基准指数: {len(benchmark_df)} 条")
         
-        curve_data = calculate_excess_return_curve(fund_df, benchmark_df)
+        curve_data = calculate_excess_return_curve(fund_df, benchmark_df, points=points)
         if curve_data is None or len(curve_data) == 0:
             print(f"  失败: 计算超额收益曲线失败")
             return None
@@ -356,33 +362,44 @@ def get_excess_return_curve_for_fund(fund_code, days=365, benchmark_df=None):
         return None
 
 
+def stability_curve(days, values):
+    """稳定性评分使用的曲线：从完整曲线中等间距采样约60个点
+    （评分的回归、波动率、上涨占比和阈值都按等间距采样标定，不使用网页曲线的LTTB降采样）
+    """
+    return values[stride_indices(len(values))]
+
+
 def calculate_stability_score(curve_json):
     """
     根据超额收益曲线计算稳定性评分
 
     参数
     ------
-    curve_json : str or list
-        JSON格式的超额收益曲线数据，或直接是list
+    curve_json : str, list or np.ndarray
+        JSON格式的超额收益曲线数据，或直接是list，或超额收益数组
 
     返回
     ------
     float or None
         稳定性评分（百分制整数，0-100），失败返回None
     """
-    if not curve_json or curve_json == "":
+    if isinstance(curve_json, np.ndarray):
+        values = curve_json.astype(float)
+    else:
+        if not curve_json or curve_json == "":
+            return None
+        try:
+            curve_data = json.loads(curve_json) if isinstance(curve_json, str) else curve_json
+        except Exception as e:
+            return None
+        if not isinstance(curve_data, list):
+            return None
+        values = np.array([item['excess_return'] for item in curve_data])
+
+    if len(values) < 2:
         return None
 
     try:
-        if isinstance(curve_json, str):
-            curve_data = json.loads(curve_json)
-        else:
-            curve_data = curve_json
-
-        if not isinstance(curve_data, list) or len(curve_data) < 2:
-            return None
-
-        values = np.array([item['excess_return'] for item in curve_data])
         n = len(values)
 
         X = np.arange(n).reshape(-1, 1)
@@ -1059,7 +1076,7 @@ def fetch_fund_details(row):
     """单只基金的详细数据获取（用于多线程）"""
     code = row["基金代码"]
     fund_name = row["基金简称"]
-    base_name = fund_name[:-1] if (fund_name.endswith('A') or fund_name.endswith('C')) else fund_name
+    base_name = strip_share_class_suffix(fund_name)
     
     result = {
         "idx": row.name,
@@ -1125,12 +1142,61 @@ def fetch_fund_details(row):
     return result
 
 
+# 上次运行补充的基金详细数据，按基金代码缓存
+ENRICHMENT_CACHE_FILE = 'fund_enrichment_cache.json'
+
+# 详细数据缓存的最长有效期（天），此外进入定期报告披露期后也会刷新
+ENRICHMENT_CACHE_DAYS = 90
+
+# 补充的详细数据列
+ENRICHMENT_FIELDS = ["成立时间", "最新规模", "换手率", "前10大重仓股占比", "持股行业集中度", "管理总规模"]
+
+
+def load_enrichment_cache():
+    """读取基金详细数据缓存，文件不存在或读取失败时返回空字典"""
+    if not os.path.exists(ENRICHMENT_CACHE_FILE):
+        return {}
+    try:
+        with open(ENRICHMENT_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取基金详细数据缓存失败: {e}")
+        return {}
+
+
+def save_enrichment_cache(enrichment_cache):
+    """保存基金详细数据缓存"""
+    with open(ENRICHMENT_CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(enrichment_cache, f, ensure_ascii=False, indent=2)
+
+
+def is_enrichment_fresh(entry, fund_name):
+    """缓存的详细数据是否仍可复用：基金简称未变、各字段都有值、未超过有效期且之后没有进入披露期"""
+    if not entry or entry.get("基金简称") != fund_name:
+        return False
+    if not all(entry.get(col) for col in ENRICHMENT_FIELDS):
+        return False
+    try:
+        update_time = datetime.strptime(entry.get("更新时间", ""), '%Y-%m-%d')
+    except ValueError:
+        return False
+    return datetime.now() - update_time < timedelta(days=ENRICHMENT_CACHE_DAYS) and not is_quarterly_data_stale(update_time)
+
+
+def report_column_min_width(column_name):
+    """周报各列的最小列宽：基金简称至少12，基金代码和收益率类列至少10"""
+    if column_name == "基金简称":
+        return 12
+    if column_name == "基金代码" or "超额" in str(column_name) or "收益率" in str(column_name):
+        return 10
+    return 0
+
 def analyze_funds():
     zzqz = get_csi_all_share_returns()
     
-    # 预先获取一次中证全指历史数据，供所有基金复用
+    # 预先获取一次中证全指历史数据（覆盖最长的曲线期限），供所有基金复用
     print("正在预先获取中证全指历史数据...")
-    benchmark_df = get_csi_all_share_history(days=365)
+    benchmark_df = get_csi_all_share_history(days=CURVE_MAX_DAYS)
     if benchmark_df is None or benchmark_df.empty:
         print("警告：无法获取中证全指数据，将在每只基金中单独获取")
         benchmark_df = None
@@ -1138,7 +1204,8 @@ def analyze_funds():
         print(f"成功获取中证全指数据：{len(benchmark_df)} 条记录")
 
     print("正在获取基金排名数据...")
-    fund_open_fund_rank_em_df = ak.fund_open_fund_rank_em(symbol="全部")
+    # 每天的排名数据按交易日写入rank_warehouse，网络获取失败时读取仓库中最新的数据
+    fund_open_fund_rank_em_df = fetch_rank_table()
     print(f"step1_原始数据：{len(fund_open_fund_rank_em_df)} 只基金")
     fund_open_fund_rank_em_df.to_excel("step1_原始数据.xlsx", index=False)
     
@@ -1186,18 +1253,30 @@ def analyze_funds():
     # fund_open_fund_rank_em_df.to_excel("step5_超额收益筛选.xlsx", index=False)
     
     # 第二步：使用多线程补充详细数据
-    fund_open_fund_rank_em_df.loc[:, "成立时间"] = ""
-    fund_open_fund_rank_em_df.loc[:, "最新规模"] = ""
-    fund_open_fund_rank_em_df.loc[:, "换手率"] = ""
-    fund_open_fund_rank_em_df.loc[:, "前10大重仓股占比"] = ""
-    fund_open_fund_rank_em_df.loc[:, "持股行业集中度"] = ""
+    for col in ENRICHMENT_FIELDS:
+        fund_open_fund_rank_em_df.loc[:, col] = ""
+    
+    # 上次运行已补充过且未过期的基金直接复用缓存，只对新进入的和过期的基金重新获取
+    enrichment_cache = load_enrichment_cache()
+    codes = fund_open_fund_rank_em_df["基金代码"].astype(str)
+    fresh_mask = pd.Series(
+        [is_enrichment_fresh(enrichment_cache.get(code), name)
+         for code, name in zip(codes, fund_open_fund_rank_em_df["基金简称"])],
+        index=fund_open_fund_rank_em_df.index, dtype=bool
+    )
+    for col in ENRICHMENT_FIELDS:
+        fund_open_fund_rank_em_df.loc[fresh_mask, col] = codes[fresh_mask].map(
+            lambda code: enrichment_cache[code].get(col, ""))
+    stale_df = fund_open_fund_rank_em_df[~fresh_mask]
+    print(f"复用缓存的详细数据：{int(fresh_mask.sum())} 只，需要重新获取：{len(stale_df)} 只")
     
     print(f"正在使用多线程补充基金详细数据（线程数：20）...")
     
+    update_time = datetime.now().strftime('%Y-%m-%d')
     # 使用ThreadPoolExecutor并行获取数据
     with ThreadPoolExecutor(max_workers=20) as executor:
         # 提交所有任务
-        futures = {executor.submit(fetch_fund_details, row): idx for idx, row in fund_open_fund_rank_em_df.iterrows()}
+        futures = {executor.submit(fetch_fund_details, row): idx for idx, row in stale_df.iterrows()}
         
         # 收集结果
         for future in tqdm(as_completed(futures), total=len(futures)):
@@ -1210,9 +1289,20 @@ def analyze_funds():
                 fund_open_fund_rank_em_df.at[idx, "前10大重仓股占比"] = result["前10大重仓股占比"]
                 fund_open_fund_rank_em_df.at[idx, "持股行业集中度"] = result["持股行业集中度"]
                 fund_open_fund_rank_em_df.at[idx, "管理总规模"] = result["管理总规模"]
+                # 所有字段都获取成功时才写入缓存，有字段失败的下次重新获取
+                if all(result[col] for col in ENRICHMENT_FIELDS):
+                    code = str(fund_open_fund_rank_em_df.at[idx, "基金代码"])
+                    enrichment_cache[code] = {col: result[col] for col in ENRICHMENT_FIELDS}
+                    enrichment_cache[code]["基金简称"] = fund_open_fund_rank_em_df.at[idx, "基金简称"]
+                    enrichment_cache[code]["更新时间"] = update_time
             except Exception as e:
                 pass
     
+    try:
+        save_enrichment_cache(enrichment_cache)
+    except Exception as e:
+        print(f"保存基金详细数据缓存失败: {e}")
+    
     # 保存补充完详细数据的结果
     fund_open_fund_rank_em_df.to_excel("step6_补充数据完成.xlsx", index=False)
     
@@ -1376,41 +1466,47 @@ def analyze_funds():
     
     print(f"\n最终筛选后剩余 {len(fund_open_fund_rank_em_df)} 只基金")
     
-    # step12：为最终筛选出的基金获取超额收益曲线
+    # step12：为最终筛选出的基金获取超额收益曲线（保存到曲线文件，Excel 中只保留汇总列）
     print("\n正在为最终筛选出的基金获取超额收益曲线...")
-    fund_open_fund_rank_em_df.loc[:, "超额收益曲线"] = ""
+    curve_values = {}
     
     # 为避免重复获取，先检查是否已获取过中证全指数据
     if benchmark_df is None:
         print("重新获取中证全指数据...")
-        benchmark_df = get_csi_all_share_history(days=365)
+        benchmark_df = get_csi_all_share_history(days=CURVE_MAX_DAYS)
     
     if benchmark_df is not None and not benchmark_df.empty:
+        # 每只基金只获取一次最长期限的净值，近3月/近6月/近1年/近3年的曲线一次矩阵运算全部算出
+        nav_by_code = {}
         with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {}
-            for idx, row in fund_open_fund_rank_em_df.iterrows():
-                future = executor.submit(get_excess_return_curve_for_fund, row["基金代码"], days=365, benchmark_df=benchmark_df)
-                futures[future] = idx
+            futures = {executor.submit(get_fund_nav_history, code, CURVE_MAX_DAYS): code
+                       for code in fund_open_fund_rank_em_df["基金代码"].astype(str).unique()}
             
             for future in tqdm(as_completed(futures), total=len(futures)):
                 try:
                     result = future.result()
-                    idx = futures[future]
-                    if result:
-                        # 将列表转换为 JSON 字符串保存到 Excel
-                        fund_open_fund_rank_em_df.at[idx, "超额收益曲线"] = json.dumps(result, ensure_ascii=False)
+                    if result is not None and not result.empty:
+                        nav_by_code[futures[future]] = result
                 except Exception as e:
                     pass
         
-        print(f"step12_超额收益曲线获取完成，共 {len(fund_open_fund_rank_em_df)} 只基金")
-        fund_open_fund_rank_em_df.to_excel("step12_含超额收益曲线.xlsx", index=False)
+        curves = compute_excess_curves(nav_by_code, benchmark_df)
+        try:
+            save_curve_store(curves)
+        except Exception as e:
+            print(f"保存超额收益曲线失败: {e}")
+        
+        # 近1年曲线（数组切片，不复制）供稳定性评分使用
+        curve_values = {code: (days, values) for code, days, values in iter_curves(curves['1y'])}
+        
+        print(f"step12_超额收益曲线获取完成，共 {len(curve_values)} 只基金有近1年曲线")
     else:
         print("警告：无法获取中证全指数据，跳过超额收益曲线获取")
     
-    # step13：根据超额收益曲线计算稳定性评分
+    # step13：根据近1年超额收益曲线计算稳定性评分（等间距采样，与原有评分口径一致）
     print("\n正在计算稳定性评分...")
-    fund_open_fund_rank_em_df.loc[:, "稳定性评分"] = fund_open_fund_rank_em_df["超额收益曲线"].apply(
-        lambda x: calculate_stability_score(x) if pd.notna(x) and x != "" else None
+    fund_open_fund_rank_em_df.loc[:, "稳定性评分"] = fund_open_fund_rank_em_df["基金代码"].astype(str).map(
+        lambda code: calculate_stability_score(stability_curve(*curve_values[code])) if code in curve_values else None
     )
     
     valid_scores = fund_open_fund_rank_em_df["稳定性评分"].notna().sum()
@@ -1420,7 +1516,7 @@ def analyze_funds():
     step13_df = step13_df.sort_values(by="稳定性评分", ascending=False, na_position='last')
     step13_df.to_excel("step13_含稳定性评分.xlsx", index=False)
     
-    # 删除不需要的列（注意：不删除"超额收益曲线"和"稳定性评分"）
+    # 删除不需要的列（注意：不删除"稳定性评分"）
     columns_to_drop = ["序号", "单位净值", "累计净值", "日增长率", "自定义", "手续费"]
     # 只删除实际存在的列
     existing_columns = [col for col in columns_to_drop if col in fund_open_fund_rank_em_df.columns]
@@ -1444,57 +1540,13 @@ def analyze_funds():
     # 保存到三个文件
     output_files = ["step11_最终结果.xlsx", dated_filename, "fund_open_fund_rank_em.xlsx"]
     
-    for file in output_files:
-        df_export.to_excel(file, index=False)
-        
-        # 打开文件并优化格式
-        wb = load_workbook(file)
-        ws = wb.active
-        
-        # 设置所有单元格居中对齐
-        alignment = Alignment(horizontal='center', vertical='center')
-        for row in ws.iter_rows():
-            for cell in row:
-                cell.alignment = alignment
-        
-        # 自适应列宽（紧凑版）
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter  # 获取列字母
-            column_name = col[0].value
-            
-            for cell in col:
-                try:
-                    # 计算字符长度（中文字符按1.5个宽度算，更贴近Excel实际显示）
-                    cell_value = str(cell.value)
-                    length = 0
-                    for char in cell_value:
-                        if '\u4e00' <= char <= '\u9fff':  # 中文字符
-                            length += 1.5
-                        else:
-                            length += 1
-                    if length > max_length:
-                        max_length = length
-                except:
-                    pass
-            
-            # 计算列宽（更紧凑）
-            adjusted_width = max_length + 1  # 加1个字符的padding就够
-            
-            # 特殊列适当加宽，但不要太大
-            if column_name == "基金简称":
-                adjusted_width = max(adjusted_width, 12)  # 基金简称至少12
-            elif column_name == "基金代码":
-                adjusted_width = max(adjusted_width, 10)  # 基金代码至少10
-            elif "超额" in str(column_name) or "收益率" in str(column_name):
-                adjusted_width = max(adjusted_width, 10)
-            
-            # 最大宽度限制（缩紧到40）
-            adjusted_width = min(adjusted_width, 40)
-            
-            ws.column_dimensions[column].width = adjusted_width
-        
-        wb.save(file)
+    # 列宽由DataFrame内容计算，写入时直接设置并居中对齐；三个文件内容相同，只写一次再复制
+    column_widths = compute_column_widths(df_export, padding=1, max_width=40, min_width=report_column_min_width)
+    with pd.ExcelWriter(output_files[0], engine=EXCEL_ENGINE) as writer:
+        df_export.to_excel(writer, index=False, sheet_name='Sheet1')
+        set_column_widths(writer, 'Sheet1', column_widths, center=True)
+    for file in output_files[1:]:
+        shutil.copyfile(output_files[0], file)
     
     print("结果已保存到 fund_open_fund_rank_em.xlsx（格式已优化）")
 
@@ -2,8 +2,14 @@
 from flask import Flask, render_template, jsonify, request
 import json
 import os
+import re
 import pandas as pd
 import numpy as np
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from curve_store import CURVE_HORIZONS, CURVE_POINTS, horizon_for_days, load_curve, curve_to_points
 
 app = Flask(__name__, 
             template_folder='templates',
@@ -13,13 +19,109 @@ app = Flask(__name__,
 try:
     import sys
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-    from analyze_funds import get_excess_return_curve_for_fund
+    from analyze_funds import get_excess_return_curve_for_fund, get_csi_all_share_history
     USE_REAL_DATA = True
     print('成功导入 analyze_funds，将使用真实数据')
 except Exception as e:
     USE_REAL_DATA = False
     print(f'导入 analyze_funds 失败: {e}，将使用模拟数据')
 
+# 曲线文件中没有的基金在后台线程池中获取，请求不等待上游接口
+CURVE_FETCH_WORKERS = 4
+
+# 后台获取结果的保留时间（秒），过期后再次请求会重新获取
+CURVE_JOB_TTL = 3600
+
+# 接口允许的数据点数范围
+CURVE_MIN_POINTS = 2
+CURVE_MAX_POINTS = 500
+
+# 基金代码格式
+FUND_CODE_PATTERN = re.compile(r'^\d{6}$')
+
+_curve_executor = ThreadPoolExecutor(max_workers=CURVE_FETCH_WORKERS)
+_curve_jobs = {}  # token -> (Future, 提交时间)
+_curve_jobs_lock = Lock()
+
+# 各期限的中证全指数据：期限 -> (DataFrame, 获取时间)，后台任务共用，CURVE_JOB_TTL 内只下载一次
+_benchmark_cache = {}
+_benchmark_lock = Lock()
+
+
+def get_benchmark(horizon):
+    """获取某个期限的中证全指数据（缓存 CURVE_JOB_TTL 秒），获取失败时返回None"""
+    with _benchmark_lock:
+        cached = _benchmark_cache.get(horizon)
+        if cached is not None and time.time() - cached[1] <= CURVE_JOB_TTL:
+            return cached[0]
+        benchmark_df = get_csi_all_share_history(days=CURVE_HORIZONS[horizon])
+        if benchmark_df is None or benchmark_df.empty:
+            return None
+        _benchmark_cache[horizon] = (benchmark_df, time.time())
+        return benchmark_df
+
+
+def fetch_curve(fund_code, horizon):
+    """后台任务：使用缓存的基准数据获取基金的完整超额收益曲线，返回 (days, values)，失败时返回None"""
+    benchmark_df = get_benchmark(horizon)
+    if benchmark_df is None:
+        return None
+    excess_curve = get_excess_return_curve_for_fund(fund_code, days=CURVE_HORIZONS[horizon],
+                                                    benchmark_df=benchmark_df, points=None)
+    if not excess_curve:
+        return None
+    # 与曲线文件相同的格式，按请求的点数降采样
+    days = np.array([item['date'] for item in excess_curve], dtype='datetime64[D]').astype(np.int32)
+    values = np.array([item['excess_return'] for item in excess_curve], dtype=np.float32)
+    return days, values
+
+
+def prune_curve_jobs(now):
+    """删除已完成且超过保留时间的后台任务（调用方持有 _curve_jobs_lock）"""
+    for token in [token for token, (future, submitted) in _curve_jobs.items()
+                  if future.done() and now - submitted > CURVE_JOB_TTL]:
+        del _curve_jobs[token]
+
+
+def submit_curve_fetch(fund_code, horizon):
+    """
+    在后台获取基金某个期限的完整超额收益曲线，同一基金同一期限同时只获取一次，
+    不同点数的请求共用同一个任务
+    返回 (token, Future)，已有未过期的任务时直接返回该任务
+    """
+    token = f"{fund_code}-{horizon}"
+    with _curve_jobs_lock:
+        prune_curve_jobs(time.time())
+        job = _curve_jobs.get(token)
+        if job is not None:
+            future, submitted = job
+            # 已完成但没有数据的任务重新获取（过期的任务已被删除）
+            expired = future.done() and (future.exception() is not None or future.result() is None)
+            if not expired:
+                return token, future
+        future = _curve_executor.submit(fetch_curve, fund_code, horizon)
+        _curve_jobs[token] = (future, time.time())
+        return token, future
+
+
+def request_points():
+    """请求参数中的数据点数（LTTB降采样），限制在允许范围内"""
+    return min(max(request.args.get('points', CURVE_POINTS, type=int), CURVE_MIN_POINTS), CURVE_MAX_POINTS)
+
+
+def curve_job_response(token, future, points=CURVE_POINTS):
+    """后台任务已完成时返回降采样到points个点的曲线数据，否则返回202和轮询用的token"""
+    if not future.done():
+        return jsonify({'code': 2, 'msg': '正在获取数据', 'token': token}), 202
+    curve = future.result()
+    if curve is not None:
+        excess_curve = curve_to_points(*curve, points=points)
+        print(f"后台获取完成: {token}，{len(excess_curve)} 个点")
+        return jsonify({'code': 0, 'data': excess_curve})
+    print(f"后台获取的数据为空: {token}")
+    return jsonify({'code': 0, 'data': []})
+
+
 @app.route('/')
 def index():
     return render_template('quant_fund_ranking.html')
@@ -81,57 +183,30 @@ def get_quant_fund_data():
 
 @app.route('/get_excess_curve/<fund_code>')
 def get_excess_curve(fund_code):
-    print(f"\n=== 请求超额收益: {fund_code} ===")
+    # days 取最接近的预先计算期限（近3月/近6月/近1年/近3年），默认近1年
+    days = request.args.get('days', 365, type=int)
+    horizon = horizon_for_days(days)
+    # points 为返回的数据点数（LTTB降采样），迷你图可以更少，详情图可以更多
+    points = request_points()
+    print(f"\n=== 请求超额收益: {fund_code}（{horizon}） ===")
+    if not FUND_CODE_PATTERN.match(fund_code):
+        return jsonify({'code': 1, 'msg': '基金代码格式错误', 'data': []}), 400
     try:
-        # 首先尝试从 Excel 文件中读取已有的数据
-        EXCEL_FILE = 'fund_open_fund_rank_em.xlsx'
-        if os.path.exists(EXCEL_FILE):
-            try:
-                df = pd.read_excel(EXCEL_FILE)
-                # 处理基金代码格式，确保匹配
-                if '基金代码' in df.columns:
-                    df['基金代码'] = df['基金代码'].apply(
-                        lambda x: str(int(x)).zfill(6) if isinstance(x, (int, float)) and not pd.isna(x) else str(x).zfill(6) if x is not None else ''
-                    )
-                    # 查找对应的基金
-                    fund_row = df[df['基金代码'] == fund_code]
-                    if len(fund_row) > 0 and '超额收益曲线' in df.columns:
-                        curve_json = fund_row.iloc[0]['超额收益曲线']
-                        if pd.notna(curve_json) and curve_json:
-                            # 尝试解析 JSON
-                            try:
-                                if isinstance(curve_json, str):
-                                    excess_curve = json.loads(curve_json)
-                                else:
-                                    excess_curve = curve_json
-                                if excess_curve and isinstance(excess_curve, list) and len(excess_curve) > 0:
-                                    print(f"从 Excel 成功读取数据: {len(excess_curve)} 个点")
-                                    if len(excess_curve) > 0:
-                                        first = excess_curve[0]
-                                        last = excess_curve[-1]
-                                        print(f"  起始: {first['date']} = {first['excess_return']*100:.2f}%")
-                                        print(f"  结束: {last['date']} = {last['excess_return']*100:.2f}%")
-                                    return jsonify({'code': 0, 'data': excess_curve})
-                            except Exception as e:
-                                print(f"解析 Excel 中的超额收益曲线失败: {e}")
-            except Exception as e:
-                print(f"从 Excel 读取失败: {e}")
+        # 首先从预先计算的曲线文件中读取，不需要联网
+        try:
+            curve = load_curve(fund_code, horizon)
+            if curve is not None:
+                excess_curve = curve_to_points(*curve, points=points)
+                print(f"从曲线文件读取数据: {len(excess_curve)} 个点")
+                return jsonify({'code': 0, 'data': excess_curve})
+        except Exception as e:
+            print(f"从曲线文件读取失败: {e}")
         
-        # Excel 中没有，才重新获取
-        print("Excel 中无数据，重新获取...")
+        # 曲线文件中没有，才在后台重新获取，请求立即返回（获取中时返回202和token，前端轮询结果）
+        print("曲线文件中无数据，后台获取...")
         if USE_REAL_DATA:
-            excess_curve = get_excess_return_curve_for_fund(fund_code, days=365)
-            if excess_curve and isinstance(excess_curve, list) and len(excess_curve) > 0:
-                print(f"成功获取真实数据: {len(excess_curve)} 个点")
-                if len(excess_curve) > 0:
-                    first = excess_curve[0]
-                    last = excess_curve[-1]
-                    print(f"  起始: {first['date']} = {first['excess_return']*100:.2f}%")
-                    print(f"  结束: {last['date']} = {last['excess_return']*100:.2f}%")
-                return jsonify({'code': 0, 'data': excess_curve})
-            else:
-                print("真实数据为空，返回空数据")
-                return jsonify({'code': 0, 'data': []})
+            token, future = submit_curve_fetch(fund_code, horizon)
+            return curve_job_response(token, future, points)
         else:
             print("USE_REAL_DATA = False，返回空数据")
             return jsonify({'code': 0, 'data': []})
@@ -142,5 +217,18 @@ def get_excess_curve(fund_code):
         # 出错时返回空数据
         return jsonify({'code': 0, 'data': []})
 
+@app.route('/get_excess_curve_result/<token>')
+def get_excess_curve_result(token):
+    """轮询后台获取的超额收益曲线"""
+    with _curve_jobs_lock:
+        job = _curve_jobs.get(token)
+    if job is None:
+        return jsonify({'code': 1, 'msg': '任务不存在', 'data': []}), 404
+    try:
+        return curve_job_response(token, job[0], request_points())
+    except Exception as e:
+        print(f'获取超额收益曲线失败: {e}')
+        return jsonify({'code': 0, 'data': []})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,238 @@
+import json
+import os
+import uuid
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+# 超额收益曲线存储目录：所有基金所有期限的数据点在一个可内存映射的npy文件中，
+# 每个点为 (day: 距1970-01-01的天数 int32, value: 超额收益 float32)；
+# index.json 记录当前的数据文件和 期限 -> 基金代码 -> [起始位置, 结束位置]
+CURVE_STORE_DIR = 'excess_curves'
+CURVE_INDEX_FILE = 'index.json'
+
+CURVE_DTYPE = np.dtype([('day', '<i4'), ('value', '<f4')])
+
+# 预先计算的期限 -> 天数
+CURVE_HORIZONS = {'3m': 91, '6m': 182, '1y': 365, '3y': 1095}
+
+# 计算所有期限需要的最长历史天数
+CURVE_MAX_DAYS = max(CURVE_HORIZONS.values())
+
+# 接口返回曲线时默认的数据点数
+CURVE_POINTS = 60
+
+_store_cache = {}
+_store_lock = Lock()
+
+
+def horizon_for_days(days):
+    """与指定天数最接近的期限"""
+    return min(CURVE_HORIZONS, key=lambda horizon: abs(CURVE_HORIZONS[horizon] - days))
+
+
+def compute_excess_curves(nav_by_code, benchmark_df, horizons=None, now=None):
+    """
+    一次计算多只基金所有期限的超额收益曲线（相对基准的累计超额收益，小数）
+
+    所有基金的累计净值按基准的交易日对齐为一个矩阵，每个期限只做一次矩阵运算：
+    各基金以期限内第一个有净值的交易日为起点，超额收益 = 基金累计收益 - 基准累计收益
+
+    Args:
+        nav_by_code (dict): 基金代码 -> 包含日期和累计净值列的DataFrame
+        benchmark_df (DataFrame): 包含日期和指数列的基准数据
+        horizons (dict, optional): 期限 -> 天数，默认CURVE_HORIZONS
+        now (datetime, optional): 计算期限起点的当前时间，默认现在
+
+    Returns:
+        dict: 期限 -> 打包的曲线数组（见pack_curves）
+    """
+    horizons = horizons or CURVE_HORIZONS
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+
+    bench = benchmark_df.drop_duplicates('日期').set_index('日期')['指数'].sort_index()
+    codes = [str(code) for code in nav_by_code]
+    nav = pd.DataFrame(
+        {str(code): df.drop_duplicates('日期').set_index('日期')['累计净值'] for code, df in nav_by_code.items()},
+        columns=codes,
+    ).reindex(bench.index)
+
+    dates = bench.index.to_numpy()
+    bench_values = bench.to_numpy(dtype=float)
+    nav_values = nav.to_numpy(dtype=float)
+
+    curves = {}
+    for horizon, days in horizons.items():
+        start = np.searchsorted(dates, (now - pd.Timedelta(days=days)).to_datetime64())
+        window = nav_values[start:]
+        window_bench = bench_values[start:]
+        valid = ~np.isnan(window)
+        if window.size == 0:
+            curves[horizon] = pack_curves(codes, dates[start:], window, valid)
+            continue
+        # 每只基金期限内第一个有净值的位置作为起点
+        first = valid.argmax(axis=0)
+        columns = np.arange(window.shape[1])
+        excess = (window / window[first, columns] - 1) - (window_bench[:, None] / window_bench[first][None, :] - 1)
+        # 少于2个数据点的基金不保存曲线
+        valid &= (valid.sum(axis=0) >= 2)[None, :]
+        curves[horizon] = pack_curves(codes, dates[start:], excess, valid)
+    return curves
+
+
+def pack_curves(codes, dates, values, valid):
+    """
+    把日期×基金的曲线矩阵打包为扁平数组：
+    codes 基金代码，offsets[i]:offsets[i+1] 为第i只基金在 days/values 中的范围，
+    days 为距1970-01-01的天数（int32），values 为超额收益（float32）
+    """
+    counts = valid.sum(axis=0)
+    keep = counts > 0
+    day_numbers = np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+    # 按基金顺序展开（转置后按行取有效值）
+    return {
+        'codes': np.asarray(codes, dtype=str)[keep],
+        'offsets': np.concatenate([[0], np.cumsum(counts[keep])]).astype(np.int64),
+        'days': np.broadcast_to(day_numbers, valid.T.shape)[valid.T].astype(np.int32),
+        'values': values.T[valid.T].astype(np.float32),
+    }
+
+
+def save_curve_store(curves, output_dir=CURVE_STORE_DIR):
+    """
+    把各期限的曲线依次写入一个新的npy数据文件，再替换索引文件指向它
+    （正在被网页服务内存映射的旧数据文件不会被覆盖，能删除时才删除）
+    """
+    data = np.empty(sum(len(packed['values']) for packed in curves.values()), dtype=CURVE_DTYPE)
+    index = {'length': len(data), 'curves': {}}
+    start = 0
+    for horizon, packed in curves.items():
+        end = start + len(packed['values'])
+        data['day'][start:end] = packed['days']
+        data['value'][start:end] = packed['values']
+        offsets = packed['offsets'] + start
+        index['curves'][horizon] = {str(code): [int(offsets[i]), int(offsets[i + 1])]
+                                    for i, code in enumerate(packed['codes'])}
+        start = end
+
+    os.makedirs(output_dir, exist_ok=True)
+    # 文件名带随机后缀，同一秒内多次保存也不会覆盖正在被使用的数据文件
+    index['file'] = f"curves_{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}.npy"
+    with open(os.path.join(output_dir, index['file']), 'xb') as f:
+        np.save(f, data)
+    index_path = os.path.join(output_dir, CURVE_INDEX_FILE)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+    for name in os.listdir(output_dir):
+        if name.endswith('.npy') and name != index['file']:
+            try:
+                os.remove(os.path.join(output_dir, name))
+            except OSError:
+                pass
+    print(f"超额收益曲线已保存到 {output_dir}（{', '.join(curves)}，共 {len(data)} 个数据点）")
+
+
+def load_curve_store(output_dir=CURVE_STORE_DIR):
+    """
+    读取索引并以内存映射方式打开数据文件（索引未变化时复用进程内的缓存）
+    返回 {'data': 结构化数组, 'curves': 期限 -> 基金代码 -> [起始, 结束]}，没有数据时返回None
+    """
+    index_path = os.path.join(output_dir, CURVE_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    mtime = os.path.getmtime(index_path)
+    with _store_lock:
+        cached = _store_cache.get(output_dir)
+        if cached is not None and cached['mtime'] == mtime:
+            return cached
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        # 空文件无法内存映射
+        data = np.load(os.path.join(output_dir, index['file']), mmap_mode='r') if index['length'] \
+            else np.empty(0, dtype=CURVE_DTYPE)
+        cached = {'data': data, 'curves': index['curves'], 'mtime': mtime}
+        _store_cache[output_dir] = cached
+        return cached
+
+
+def iter_curves(packed):
+    """依次返回打包数组中每只基金的 (基金代码, days, values)"""
+    offsets = packed['offsets']
+    for i, code in enumerate(packed['codes']):
+        yield str(code), packed['days'][offsets[i]:offsets[i + 1]], packed['values'][offsets[i]:offsets[i + 1]]
+
+
+def load_curve(code, horizon, output_dir=CURVE_STORE_DIR):
+    """
+    读取一只基金某个期限的曲线，返回 (days, values)，没有数据时返回None
+    返回的是内存映射数组的切片，不复制数据
+    """
+    store = load_curve_store(output_dir)
+    if store is None:
+        return None
+    position = store['curves'].get(horizon, {}).get(str(code))
+    if position is None:
+        return None
+    curve = store['data'][position[0]:position[1]]
+    return curve['day'], curve['value']
+
+
+def stride_indices(n, points=CURVE_POINTS):
+    """按固定步长等间距采样到约points个点的下标，保留第一天和最后一天
+    （稳定性评分的阈值按这种采样标定，评分使用它而不是LTTB）
+    """
+    if n <= points:
+        return np.arange(n)
+    indices = np.arange(0, n, max(1, n // points))
+    if indices[-1] != n - 1:
+        indices = np.append(indices, n - 1)
+    return indices
+
+
+def lttb_indices(values, points=CURVE_POINTS, x=None):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留的points个点的下标
+
+    第一个和最后一个点总是保留；中间的点均分为points-2个桶，每个桶保留与
+    上一个保留点、下一个桶均值构成的三角形面积最大的点，峰值和谷值不会被丢掉
+
+    Args:
+        values: 曲线的值
+        points (int): 保留的点数，不少于原数据时不降采样
+        x (optional): 曲线的横坐标（如日期天数），默认按等间距处理
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n <= points:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1])[-points:] if points > 0 else np.arange(0)
+    x = np.arange(n, dtype=float) if x is None else np.asarray(x, dtype=float)
+
+    # 中间points-2个桶的边界（第一个和最后一个点单独成桶）
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    selected = np.empty(points, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i < points - 3 else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = values[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (values[start:end] - values[a])
+                      - (x[a] - x[start:end]) * (avg_y - values[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def curve_to_points(days, values, points=CURVE_POINTS):
+    """把曲线降采样到points个点，并转换为接口使用的格式 [{'date': 'YYYY-MM-DD', 'excess_return': 小数}, ...]"""
+    indices = lttb_indices(values, points, x=days)
+    dates = np.asarray(days, dtype=np.int64)[indices].astype('datetime64[D]').astype(str)
+    return [{'date': date, 'excess_return': round(float(value), 6)} for date, value in zip(dates, np.asarray(values)[indices])]
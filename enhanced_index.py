@@ -14,12 +14,16 @@ from flask import Flask, jsonify, request, render_template
 import os
 import json
 import numpy as np
-from openpyxl import load_workbook
 
 from fund_data_processor import get_fund_name_by_code
 from fund_search_parser import fetch_and_parse_fund_search
 from jiuquan_fund import parse_fund_data
-from jiuquaner_fund_style import get_fund_list, batch_get_style
+from jiuquaner_fund_style import (get_fund_list, batch_get_style, scan_style, strip_share_class_suffix,
+                                  name_exclude_mask, EQUITY_FUND_TYPES)
+from run_cache import RunCache, cached_call
+from excel_format import EXCEL_ENGINE, compute_column_widths, set_column_widths
+from trading_calendar import run_if_new_trading_data
+from rank_warehouse import fetch_rank_table
 
 # # Flask应用配置
 # app = Flask(__name__)
@@ -108,107 +112,158 @@ def get_fund_info(fund_code):
 
     return result
 
-def fetch_fund_data(fund_type):
-    """获取指定类型基金数据（只保留各时间段前10名的基金）"""
+# 定时任务名称（用于记录已处理的交易日）
+INDEX_RANK_JOB = '指数基金排名更新'
+
+# 指数基金筛选时排除的基金简称关键词
+INDEX_EXCLUDE_KEYWORDS = ["红利", "基本面", "价值", "非银", "成长", "低波动","信息技术","周期","非周期","地产","有色","医药","保险","金融","持有","自由现金流"]
+
+# 用于筛选前10名的收益率列
+TOP_RETURN_COLUMNS = ['近1月', '近3月', '近6月', '近1年', '今年来']
+
+
+def load_rank_table():
+    """获取全部开放式基金排名数据（每次运行只需获取一次，各基金类型共享只读使用）
+    获取到的数据按交易日存入rank_warehouse，网络获取失败时读取仓库中最新的数据
+    """
+    print("正在获取全部基金排名数据...")
+    rank_df = fetch_rank_table()
+    print(f"共获取 {len(rank_df)} 只基金的排名数据")
+    return rank_df
+
+def select_top_funds(fund_df):
+    """筛选出在各时间段任意一个进入前10的基金"""
+    top_indices = set()
+    for col in TOP_RETURN_COLUMNS:
+        if col in fund_df.columns:
+            top_indices.update(fund_df[col].nlargest(10).index)
+    return fund_df.loc[list(top_indices)].copy()
+
+def select_index_funds(rank_df, fund_type):
+    """在共享的排名数据上用向量化掩码筛选指定类型的C份额基金（不修改rank_df）"""
+    names = rank_df["基金简称"]
+    mask = (
+        names.str.contains(fund_type, na=False, regex=False)
+        & names.str.contains("C", na=False, regex=False)
+        & rank_df["近6月"].notna()
+        & ~names.str.contains('|'.join(INDEX_EXCLUDE_KEYWORDS), na=False)
+    )
+    return select_top_funds(rank_df[mask])
+
+# 基金详情列
+DETAIL_COLUMNS = ["成立时间", "最新规模", "换手率", "前10大重仓股占比", "持股行业集中度"]
+
+# 基金详情获取的并发数
+ENRICH_MAX_WORKERS = 20
+
+
+def fetch_fund_detail(code, cache=None):
+    """获取单只基金的成立时间、A/C份额合并规模、换手率、重仓股占比和行业集中度
+    无法获取基金名称时返回None
+    cache: 可选，本次运行共享的RunCache，同一只基金的各项数据只抓取一次
+    """
+    code = str(code)
+    # 1. 根据基金代码查找基金名称
+    fund_name = cached_call(cache, 'name', code, get_fund_name_by_code, code)
+    if not fund_name:
+        print(f"无法获取基金 {code} 的名称，跳过该基金")
+        return None
+    detail = {col: "" for col in DETAIL_COLUMNS}
+    base_name = strip_share_class_suffix(fund_name)
+    # 2. 根据基金名称查找对应的基金代码(A+C)
+    code_names = cached_call(cache, 'search', base_name, fetch_and_parse_fund_search, base_name)
+    # 3. 获取A类和C类基金的规模数据并累加
+    if isinstance(code_names, list) and len(code_names) > 0:
+        total_scale = None
+        for code_name in code_names:
+            info = cached_call(cache, 'info', code_name['code'], get_fund_info, code_name['code'])
+            scale_match = re.search(r'([\d.]+)亿元', info['最新规模'])
+            if scale_match:
+                total_scale = (total_scale or 0) + float(scale_match.group(1))
+        if total_scale is not None:
+            detail["最新规模"] = f"{total_scale:.2f}亿元"
+    try:
+        info = cached_call(cache, 'info', code, get_fund_info, code)
+        detail["成立时间"] = info.get('成立时间', '')
+        # 获取换手率和重仓股信息
+        fund_detail = cached_call(cache, 'detail', code, parse_fund_data, code)
+        if fund_detail:
+            for col in ("换手率", "前10大重仓股占比", "持股行业集中度"):
+                if col in fund_detail:
+                    detail[col] = fund_detail[col]
+    except Exception as e:
+        print(f"基金代码{code}查询失败: {e}")
+    return detail
+
+def enrich_funds(codes, max_workers=ENRICH_MAX_WORKERS, desc="获取基金详情", cache=None):
+    """按基金代码去重后有界并发获取基金详情，返回 基金代码 -> 详情 的字典"""
+    unique_codes = list(dict.fromkeys(str(code) for code in codes))
+    details = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_fund_detail, code, cache): code for code in unique_codes}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            code = futures[future]
+            try:
+                details[code] = future.result()
+            except Exception as e:
+                print(f"基金代码{code}查询失败: {e}")
+    return details
+
+def seed_style_rows(cache, fund_codes, result_df):
+    """把风格数据的结果按基金代码写入缓存
+    fund_codes 为已成功请求的基金（请求失败的不应传入）：其中没有返回数据（如市值为0）的基金记为None，避免重复请求
+    """
+    rows = {}
+    if result_df is not None and not result_df.empty:
+        rows = {str(row['基金代码']): row for row in result_df.to_dict('records')}
+    for code in fund_codes:
+        cache.seed('style', code, rows.get(str(code)))
+
+def apply_fund_details(fund_df, details):
+    """把基金详情写入DataFrame的详情列，未获取到的保持为空字符串"""
+    codes = fund_df["基金代码"].astype(str)
+    for col in DETAIL_COLUMNS:
+        fund_df.loc[:, col] = codes.map(lambda code: (details.get(code) or {}).get(col, "")).values
+    return fund_df
+
+def fetch_fund_data(fund_type, rank_df=None, enrich=True, cache=None):
+    """获取指定类型基金数据（只保留各时间段前10名的基金）
+    rank_df: 可选，共享的全部基金排名数据，不提供时重新获取
+    enrich: 是否获取基金详情，为False时只做筛选，由调用方统一补充详情
+    cache: 可选，本次运行共享的RunCache
+    """
     try:
         # 获取所有基金基础信息
-        fund_open_fund_rank_em_df = ak.fund_open_fund_rank_em(symbol="全部")
-        fund_df = fund_open_fund_rank_em_df[fund_open_fund_rank_em_df["基金简称"].str.contains(fund_type, na=False)]
-        fund_df = fund_df[fund_df["基金简称"].str.contains("C", na=False)].copy()
-
-        # 过滤掉"近6月"为空的数据
-        fund_df = fund_df.dropna(subset=['近6月']).copy()
-
-        exclude_keywords = ["红利", "基本面", "价值", "非银", "成长", "低波动","信息技术","周期","非周期","地产","有色","医药","保险","金融","持有","自由现金流"]
-        for keyword in exclude_keywords:
-            fund_df = fund_df[~fund_df["基金简称"].str.contains(keyword, na=False)].copy()
-
-        # 筛选出在各时间段任意一个进入前10的基金
-        return_columns = ['近1月', '近3月', '近6月', '近1年', '今年来']
-        top_indices = set()
-        for col in return_columns:
-            if col in fund_df.columns:
-                top_10_idx = fund_df[col].nlargest(10).index
-                top_indices.update(top_10_idx)
-
-        fund_df = fund_df.loc[list(top_indices)].copy()
+        if rank_df is None:
+            rank_df = load_rank_table()
+        fund_df = select_index_funds(rank_df, fund_type)
         print(f"{fund_type}基金: 从全部基金中筛选出 {len(fund_df)} 只各时间段前10基金")
 
         if fund_df.empty:
             return pd.DataFrame()
 
-        fund_df.loc[:, "成立时间"] = ""
-        fund_df.loc[:, "最新规模"] = ""
-        fund_df.loc[:, "换手率"] = ""
-        fund_df.loc[:, "前10大重仓股占比"] = ""
-        fund_df.loc[:, "持股行业集中度"] = ""
-
-        for idx, row in tqdm(fund_df.iterrows(), total=fund_df.shape[0], desc=f"获取{fund_type}基金详情"):
-            code = row["基金代码"]
-            # 1. 根据基金代码查找基金名称 - 即使失败也继续
-            fund_name = get_fund_name_by_code(str(code))
-            if not fund_name:
-                print(f"无法获取基金 {code} 的名称，跳过该基金")
-                continue
-            base_name = fund_name
-            if fund_name.endswith('A') or fund_name.endswith('C'):
-                base_name = fund_name[:-1]
-            # 2. 根据基金名称查找对应的基金代码(A+C)
-            code_names = fetch_and_parse_fund_search(base_name)
-            # 3. 获取A类和C类基金的规模数据
-            if isinstance(code_names, list) and len(code_names) > 0:
-                for code_name in code_names:
-                    info = get_fund_info(code_name['code'])
-
-                # 解析并累加规模数据
-                scale_match = re.search(r'([\d.]+)亿元', info['最新规模'])
-                if scale_match:
-                    scale_value = float(scale_match.group(1))
-                    # 如果当前值是空字符串，则初始化为0
-                    current_scale = fund_df.loc[idx, "最新规模"]
-                    if current_scale == "":
-                        current_scale = 0
-                    else:
-                        # 提取当前值中的数字部分
-                        current_match = re.search(r'([\d.]+)亿元', str(current_scale))
-                        if current_match:
-                            current_scale = float(current_match.group(1))
-                        else:
-                            current_scale = 0
-                    # 累加规模值
-                    new_scale = current_scale + scale_value
-                    fund_df.loc[idx, "最新规模"] = f"{new_scale:.2f}亿元"
-            try:
-                info = get_fund_info(code)
-                fund_df.loc[idx, "成立时间"] = info['成立时间']
-                # 获取换手率和重仓股信息
-                fund_detail = parse_fund_data(code)
-                if fund_detail:
-                    if '换手率' in fund_detail:
-                        fund_df.loc[idx, "换手率"] = fund_detail['换手率']
-                    if '前10大重仓股占比' in fund_detail:
-                        fund_df.loc[idx, "前10大重仓股占比"] = fund_detail['前10大重仓股占比']
-                    if '持股行业集中度' in fund_detail:
-                        fund_df.loc[idx, "持股行业集中度"] = fund_detail['持股行业集中度']
-            except Exception as e:
-                print(f"基金代码{code}查询失败: {e}")
+        if enrich:
+            apply_fund_details(fund_df, enrich_funds(fund_df["基金代码"], desc=f"获取{fund_type}基金详情", cache=cache))
 
         return fund_df.sort_values(by='近6月', ascending=False)
     except Exception as e:
         print(f"获取{fund_type}基金数据时出错: {e}")
         return pd.DataFrame()
 
-def fetch_small_fund_data():
-    """获取小微盘基金数据（只保留各时间段前10名的基金）"""
+def fetch_small_fund_data(rank_df=None, enrich=True, cache=None):
+    """获取小微盘基金数据（只保留各时间段前10名的基金）
+    rank_df: 可选，共享的全部基金排名数据，不提供时重新获取
+    enrich: 是否获取基金详情，为False时只做筛选，由调用方统一补充详情
+    cache: 可选，本次运行共享的RunCache，扫描到的风格数据会写入其中供市值评分复用
+    """
     try:
         # 从 jiuquaner_fund_style.py 获取市值评分 < 25 的基金代码
         print('正在从韭圈儿获取市值评分 < 25 的基金...')
-        fund_list_df = get_fund_list(filter_types=['股票', '混合', '指数'])
+        fund_list_df = get_fund_list(filter_types=EQUITY_FUND_TYPES)
         
         # 提前过滤债券和定开基金
         if 'name' in fund_list_df.columns:
-            mask = ~fund_list_df['name'].str.contains('债券|定开|货币|人民币|美元|300|500|定期|纯债|A50|持有|黄金|A', na=False)
-            fund_list_df = fund_list_df[mask].copy()
+            fund_list_df = fund_list_df[name_exclude_mask(fund_list_df)].copy()
         
         fund_codes = fund_list_df['code'].tolist()
         
@@ -217,8 +272,11 @@ def fetch_small_fund_data():
         if 'code' in fund_list_df.columns and 'name' in fund_list_df.columns:
             fund_name_map = dict(zip(fund_list_df['code'], fund_list_df['name']))
         
-        # 批量获取基金风格数据
-        result_df, filtered_df = batch_get_style(fund_codes, fund_name_map=fund_name_map, max_workers=20, filter_market_cap_threshold=25)
+        # 流式扫描基金风格数据（当天的扫描目录，中断后可续扫），请求失败的基金不写入缓存
+        result_df, filtered_df, scanned_codes = scan_style(fund_codes, fund_name_map=fund_name_map, max_workers=20,
+                                                           filter_market_cap_threshold=25)
+        if cache is not None:
+            seed_style_rows(cache, scanned_codes, result_df)
         
         if filtered_df is not None and not filtered_df.empty:
             small_funds_df = pd.DataFrame({'code': filtered_df['基金代码'].tolist()})
@@ -231,366 +289,273 @@ def fetch_small_fund_data():
                 small_funds_df = pd.DataFrame({'code': []})
 
         # 获取所有基金基础信息
-        fund_open_fund_rank_em_df = ak.fund_open_fund_rank_em(symbol="全部")
-
-        # 筛选出符合条件的基金
-        fund_df = fund_open_fund_rank_em_df[fund_open_fund_rank_em_df["基金代码"].isin(small_funds_df["code"])].copy()
+        if rank_df is None:
+            rank_df = load_rank_table()
 
-        # 筛选出在各时间段任意一个进入前10的基金
-        return_columns = ['近1月', '近3月', '近6月', '近1年', '今年来']
-        top_indices = set()
-        for col in return_columns:
-            if col in fund_df.columns:
-                top_10_idx = fund_df[col].nlargest(10).index
-                top_indices.update(top_10_idx)
-
-        fund_df = fund_df.loc[list(top_indices)].copy()
+        # 筛选出符合条件的基金，并保留在各时间段任意一个进入前10的基金
+        fund_df = select_top_funds(rank_df[rank_df["基金代码"].isin(small_funds_df["code"])])
         print(f"小微盘基金: 从全部基金中筛选出 {len(fund_df)} 只各时间段前10基金")
 
         if fund_df.empty:
             return pd.DataFrame()
 
-        fund_df.loc[:, "成立时间"] = ""
-        fund_df.loc[:, "最新规模"] = ""
-        fund_df.loc[:, "换手率"] = ""
-        fund_df.loc[:, "前10大重仓股占比"] = ""
-        fund_df.loc[:, "持股行业集中度"] = ""
-
-        for idx, row in tqdm(fund_df.iterrows(), total=fund_df.shape[0], desc="获取小微盘基金详情"):
-            code = row["基金代码"]
-            # 1. 根据基金代码查找基金名称 - 即使失败也继续
-            fund_name = get_fund_name_by_code(str(code))
-            if not fund_name:
-                print(f"无法获取基金 {code} 的名称，跳过该基金")
-                continue
-            base_name = fund_name
-            if fund_name.endswith('A') or fund_name.endswith('C'):
-                base_name = fund_name[:-1]
-            # 2. 根据基金名称查找对应的基金代码(A+C)
-            code_names = fetch_and_parse_fund_search(base_name)
-            # 3. 获取A类和C类基金的规模数据
-            if isinstance(code_names, list) and len(code_names) > 0:
-                for code_name in code_names:
-                    info = get_fund_info(code_name['code'])
-
-                # 解析并累加规模数据
-                scale_match = re.search(r'([\d.]+)亿元', info['最新规模'])
-                if scale_match:
-                    scale_value = float(scale_match.group(1))
-                    # 如果当前值是空字符串，则初始化为0
-                    current_scale = fund_df.loc[idx, "最新规模"]
-                    if current_scale == "":
-                        current_scale = 0
-                    else:
-                        # 提取当前值中的数字部分
-                        current_match = re.search(r'([\d.]+)亿元', str(current_scale))
-                        if current_match:
-                            current_scale = float(current_match.group(1))
-                        else:
-                            current_scale = 0
-                    # 累加规模值
-                    new_scale = current_scale + scale_value
-                    fund_df.loc[idx, "最新规模"] = f"{new_scale:.2f}亿元"
-            try:
-                info = get_fund_info(code)
-                fund_df.loc[idx, "成立时间"] = info['成立时间']
-                # 获取换手率和重仓股信息
-                fund_detail = parse_fund_data(code)
-                if fund_detail:
-                    if '换手率' in fund_detail:
-                        fund_df.loc[idx, "换手率"] = fund_detail['换手率']
-                    if '前10大重仓股占比' in fund_detail:
-                        fund_df.loc[idx, "前10大重仓股占比"] = fund_detail['前10大重仓股占比']
-                    if '持股行业集中度' in fund_detail:
-                        fund_df.loc[idx, "持股行业集中度"] = fund_detail['持股行业集中度']
-            except Exception as e:
-                print(f"基金代码{code}查询失败: {e}")
+        if enrich:
+            apply_fund_details(fund_df, enrich_funds(fund_df["基金代码"], desc="获取小微盘基金详情", cache=cache))
 
         return fund_df.sort_values(by='近6月', ascending=False)
     except Exception as e:
         print(f"获取小微盘基金数据时出错: {e}")
         return pd.DataFrame()
 
-def highlight_top_50_all_columns(df):
-    """为表格数据添加样式标记"""
-    # 创建一个样式DataFrame，默认为空字符串（无样式）
-    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+# 每列前N名标黄
+TOP_N_HIGHLIGHT = 10
 
-    # 定义收益率列（去掉近1周）
-    return_columns = ['近1月', '近3月', '近6月', '近1年', '今年来']
-
-    # 记录每个基金在多少个收益率列中进入前10
-    top_count = {idx: 0 for idx in df.index}
-
-    # 对每个收益率列，标记其前10名
-    for col in return_columns:
-        if col in df.columns:
-            # 获取该列排序后的前10个索引
-            top_10_idx = df[col].nlargest(10).index
-            # 将对应位置设置为黄色背景
-            styles.loc[top_10_idx, col] = 'background-color: yellow'
-            # 更新每个基金进入前10的次数
-            for idx in top_10_idx:
-                top_count[idx] += 1
-
-    # 对至少有3列进入前10的基金，将基金简称设置为金黄色背景
-    for idx, count in top_count.items():
-        if count >= 3:  # 至少有3列进入前10（共5个时间段）
-            # 标注基金简称为金黄色
-            styles.loc[idx, '基金简称'] = 'background-color: gold'
+# 至少有N列进入前10的基金，基金简称标金黄色
+GOLD_MIN_HITS = 3
 
+# 超额收益率表格中标记前10名的列
+EXCESS_HIGHLIGHT_COLUMNS = ['近1周超额', '近1月超额', '近3月超额', '近6月超额', '近1年超额', '近2年超额', '近3年超额', '今年来超额']
+
+
+def top_n_masks(df, columns, n=TOP_N_HIGHLIGHT):
+    """用rank一次性计算各列前n名的布尔掩码（与Excel的前10项规则一致，与第n名相同的值都算入前n名）"""
+    columns = [col for col in columns if col in df.columns]
+    numeric = df[columns].apply(pd.to_numeric, errors='coerce')
+    return numeric.rank(method='min', ascending=False) <= n
+
+def gold_mask(masks):
+    """至少有GOLD_MIN_HITS列进入前10的基金"""
+    return masks.sum(axis=1) >= GOLD_MIN_HITS
+
+def highlight_columns(df, columns):
+    """根据前10名掩码生成样式DataFrame：前10名标黄，多列进入前10的基金简称标金黄色"""
+    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+    masks = top_n_masks(df, columns)
+    styles[masks.columns] = np.where(masks, 'background-color: yellow', '')
+    if '基金简称' in df.columns:
+        styles.loc[gold_mask(masks), '基金简称'] = 'background-color: gold'
     return styles
 
+def highlight_top_50_all_columns(df):
+    """为表格数据添加样式标记（收益率列去掉近1周）"""
+    return highlight_columns(df, TOP_RETURN_COLUMNS)
+
+def write_highlighted_sheet(writer, fund_df, sheet_name, columns):
+    """写入工作表并标记前10名
+    xlsxwriter引擎下直接写入数据，前10名用条件格式标黄，金黄色的基金简称直接写入单元格格式；
+    其他引擎回退到pandas Styler
+    """
+    if writer.engine != 'xlsxwriter':
+        styled_df = fund_df.style.apply(highlight_columns, columns=columns, axis=None)
+        styled_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        return
+
+    fund_df.to_excel(writer, sheet_name=sheet_name, index=False)
+    if fund_df.empty:
+        return
+    worksheet = writer.sheets[sheet_name]
+    yellow_format = writer.book.add_format({'bg_color': 'yellow'})
+    gold_format = writer.book.add_format({'bg_color': 'gold'})
+    last_row = len(fund_df)
+
+    masks = top_n_masks(fund_df, columns)
+    for col in masks.columns:
+        col_idx = fund_df.columns.get_loc(col)
+        worksheet.conditional_format(1, col_idx, last_row, col_idx,
+                                     {'type': 'top', 'value': TOP_N_HIGHLIGHT, 'format': yellow_format})
+
+    if '基金简称' in fund_df.columns:
+        name_idx = fund_df.columns.get_loc('基金简称')
+        names = fund_df['基金简称'].to_numpy()
+        for row in np.flatnonzero(gold_mask(masks).to_numpy()):
+            worksheet.write(row + 1, name_idx, names[row], gold_format)
+
 def save_to_excel(writer, fund_df, sheet_name):
     """保存数据到Excel文件"""
     if fund_df is not None and not fund_df.empty:  # 确保DataFrame不为空
-        styled_df = fund_df.style.apply(highlight_top_50_all_columns, axis=None)
-        styled_df.to_excel(writer, sheet_name=sheet_name, index=False)
+        write_highlighted_sheet(writer, fund_df, sheet_name, TOP_RETURN_COLUMNS)
     else:
         print(f"没有 {sheet_name} 数据可保存")
 
 def highlight_excess_returns(df):
     """为超额收益率表格添加样式标记"""
-    # 创建一个样式DataFrame，默认为空字符串（无样式）
-    styles = pd.DataFrame('', index=df.index, columns=df.columns)
-
-    # 定义超额收益率列
-    excess_return_columns = ['近1周超额', '近1月超额', '近3月超额', '近6月超额', '近1年超额', '近2年超额', '近3年超额', '今年来超额']
-
-    # 记录每个基金在多少个超额收益率列中进入前10
-    top_count = {idx: 0 for idx in df.index}
-
-    # 对每个超额收益率列，标记其前10名
-    for col in excess_return_columns:
-        if col in df.columns:
-            # 获取该列排序后的前10个索引
-            top_10_idx = df[col].nlargest(10).index
-            # 将对应位置设置为黄色背景
-            styles.loc[top_10_idx, col] = 'background-color: yellow'
-            # 更新每个基金进入前10的次数
-            for idx in top_10_idx:
-                top_count[idx] += 1
-
-    # 对至少有3列进入前10的基金，将基金简称设置为金黄色背景
-    for idx, count in top_count.items():
-        if count >= 3:  # 至少有3列进入前10
-            # 标注基金简称为金黄色
-            styles.loc[idx, '基金简称'] = 'background-color: gold'
-
-    return styles
-
-def calculate_excess_returns(writer):
-    """计算超额收益率并保存到Excel文件"""
+    return highlight_columns(df, EXCESS_HIGHLIGHT_COLUMNS)
+
+# 各指数基金类型对应的基准基金（场内ETF）
+EXCESS_BENCHMARKS = {
+    "沪深300": "510300",
+    "中证500": "512510",
+    "A500": "563360",
+    "中证800": "515810",
+    "中证1000": "516300",
+    "中证2000": "563300",
+    "国证2000": "159907"
+}
+
+# 小微盘基金的基准基金（场外基金）
+SMALL_FUND_BENCHMARK = "320016"
+
+# 计算超额收益的收益率列
+EXCESS_RETURN_COLUMNS = ['近1周', '近1月', '近3月', '近6月', '近1年', '近2年', '近3年', '今年来']
+
+# 超额收益工作表保留的列
+EXCESS_COLUMNS_TO_KEEP = ["基金代码", "基金简称", "日期", "近1周超额", "近1月超额", "近3月超额", "近6月超额",
+                          "近1年超额", "近2年超额", "近3年超额", "今年来超额", "成立时间", "最新规模", "市值评分", "换手率",
+                          "前10大重仓股占比", "持股行业集中度"]
+
+
+def to_return_fraction(values):
+    """把收益率（数值或带%的字符串）转换为小数"""
+    return pd.to_numeric(values.astype(str).str.rstrip('%'), errors='coerce') / 100
+
+def get_benchmark_returns(benchmark_source_df, benchmark_code):
+    """获取基准基金各时间段收益率（小数），缺失的时间段记为0；找不到基准时返回None"""
+    benchmark_df = benchmark_source_df[benchmark_source_df["基金代码"] == benchmark_code]
+    if benchmark_df.empty:
+        return None
+    return to_return_fraction(benchmark_df.iloc[0].reindex(EXCESS_RETURN_COLUMNS)).fillna(0)
+
+def calculate_excess_returns(temp_data, rank_df=None):
+    """根据内存中的基金数据计算超额收益率
+    temp_data: 工作表名 -> 基金DataFrame，包含 '{基金类型}基金' 和 '小微盘'
+    rank_df: 可选，共享的全部基金排名数据（用于小微盘基准320016），不提供时重新获取
+    返回 超额工作表名 -> DataFrame 的字典
+    """
+    excess_sheets = {}
     try:
-        # 定义基金类型与基准基金代码的映射关系
-        benchmark_map = {
-            "沪深300": "510300",
-            "中证500": "512510",
-            "A500":"563360",
-            "中证800": "515810",
-            "中证1000": "516300",
-            "中证2000": "563300",
-            "国证2000": "159907"
-        }
-        # 定义收益率列
-        return_columns = ['近1周', '近1月', '近3月', '近6月', '近1年', '近2年', '近3年', '今年来']
-        # 获取基金排名数据
+        # 每个工作表对应的基准收益率
+        benchmarks = {}
         fund_exchange_rank_em_df = ak.fund_exchange_rank_em()
-        fund_open_fund_rank_em_df = ak.fund_open_fund_rank_em(symbol="混合型")
-        # 为每种基金类型计算超额收益率
-        for fund_type, benchmark_code in benchmark_map.items():
-            print(f"正在处理{fund_type}基金的超额收益率，基准基金代码：{benchmark_code}")
-            
-            # 读取已保存的基金数据
-            try:
-                fund_df = pd.read_excel('index-fund.xlsx', sheet_name=f'{fund_type}基金')
-            except:
-                print(f"无法读取{fund_type}基金数据")
-                continue
-            
-            if fund_df.empty:
+        for fund_type, benchmark_code in EXCESS_BENCHMARKS.items():
+            sheet_name = f'{fund_type}基金'
+            if sheet_name not in temp_data or temp_data[sheet_name].empty:
                 continue
-            
-            # 获取基准基金数据
-            benchmark_df = fund_exchange_rank_em_df[fund_exchange_rank_em_df["基金代码"] == benchmark_code]
-            
-            if benchmark_df.empty:
+            print(f"正在处理{fund_type}基金的超额收益率，基准基金代码：{benchmark_code}")
+            benchmark_returns = get_benchmark_returns(fund_exchange_rank_em_df, benchmark_code)
+            if benchmark_returns is None:
                 print(f"未找到{fund_type}基金的基准基金{benchmark_code}")
                 continue
-                
-            # 获取基准收益率
-            benchmark_returns = {}
-            for col in return_columns:
-                if col in benchmark_df.columns:
-                    # 处理数值数据，确保正确转换
-                    value = benchmark_df[col].iloc[0]
-                    if pd.isna(value):
-                        benchmark_returns[col] = 0
-                    else:
-                        # 如果是字符串，去除%符号并转换为数值
-                        if isinstance(value, str):
-                            benchmark_returns[col] = pd.to_numeric(value.rstrip('%'), errors='coerce') / 100
-                        else:
-                            # 如果已经是数值类型，直接使用
-                            benchmark_returns[col] = pd.to_numeric(value, errors='coerce') / 100
-                else:
-                    benchmark_returns[col] = 0
-            
-            # 计算超额收益率
-            for col in return_columns:
-                if col in fund_df.columns:
-                    # 创建超额收益率列名
-                    excess_col = f'{col}超额'
-                    # 将原始收益率转换为数值
-                    fund_df[col] = pd.to_numeric(fund_df[col].astype(str).str.rstrip('%'), errors='coerce') / 100
-                    # 计算超额收益率（保持数值格式）
-                    fund_df[excess_col] = (fund_df[col] - benchmark_returns[col])*100
-            
-            # 只保留指定的列
-            columns_to_keep = ["基金代码", "基金简称", "日期", "近1周超额", "近1月超额", "近3月超额", "近6月超额", 
-                              "近1年超额", "近2年超额", "近3年超额", "今年来超额", "成立时间", "最新规模", "市值评分", "换手率",
-                               "前10大重仓股占比", "持股行业集中度"]
-            # 检查哪些列实际存在于DataFrame中
-            existing_columns = [col for col in columns_to_keep if col in fund_df.columns]
-            fund_df = fund_df[existing_columns]
-            
+            benchmarks[sheet_name] = benchmark_returns
+
+        if '小微盘' in temp_data and not temp_data['小微盘'].empty:
+            fund_open_fund_rank_em_df = rank_df if rank_df is not None else load_rank_table()
+            benchmark_returns = get_benchmark_returns(fund_open_fund_rank_em_df, SMALL_FUND_BENCHMARK)
+            if benchmark_returns is None:
+                print(f"未找到小微盘基金的基准基金{SMALL_FUND_BENCHMARK}")
+            else:
+                benchmarks['小微盘'] = benchmark_returns
+
+        if not benchmarks:
+            return excess_sheets
+
+        # 把所有工作表拼成一张表，一次性减去各行对应的基准收益率
+        combined = pd.concat({sheet_name: temp_data[sheet_name] for sheet_name in benchmarks})
+        return_columns = [col for col in EXCESS_RETURN_COLUMNS if col in combined.columns]
+        fund_returns = combined[return_columns].apply(to_return_fraction)
+        benchmark_matrix = pd.DataFrame(benchmarks).T.reindex(columns=return_columns)
+        row_benchmarks = benchmark_matrix.reindex(combined.index.get_level_values(0)).to_numpy()
+        excess = pd.DataFrame((fund_returns.to_numpy() - row_benchmarks) * 100,
+                              index=combined.index,
+                              columns=[f'{col}超额' for col in return_columns])
+        combined = pd.concat([combined, excess], axis=1)
+
+        for sheet_name in benchmarks:
+            # 只保留指定的列（检查哪些列实际存在于原DataFrame中）
+            existing_columns = [col for col in EXCESS_COLUMNS_TO_KEEP
+                                if col in temp_data[sheet_name].columns or col in excess.columns]
+            fund_df = combined.loc[sheet_name, existing_columns].copy()
             # 确保基金代码为6位，不足的向前填充0
             if "基金代码" in fund_df.columns:
                 fund_df["基金代码"] = fund_df["基金代码"].astype(str).str.zfill(6)
-            
-            # 保存带有超额收益率的数据，并应用样式
-            styled_df = fund_df.style.apply(highlight_excess_returns, axis=None)
-            styled_df.to_excel(writer, sheet_name=f'{fund_type}基金_超额', index=False)
-        
-        # 单独处理小微盘基金
-        try:
-            small_fund_df = pd.read_excel('index-fund.xlsx', sheet_name='小微盘')
-            if small_fund_df.empty:
-                return
-            # 小微盘基金使用320016作为基准
-            benchmark_code = "320016"
-            benchmark_df = fund_open_fund_rank_em_df[fund_open_fund_rank_em_df["基金代码"] == benchmark_code]
-            
-            if not benchmark_df.empty:
-                # 获取基准收益率
-                benchmark_returns = {}
-                for col in return_columns:
-                    if col in benchmark_df.columns:
-                        # 处理数值数据，确保正确转换
-                        value = benchmark_df[col].iloc[0]
-                        if pd.isna(value):
-                            benchmark_returns[col] = 0
-                        else:
-                            # 如果是字符串，去除%符号并转换为数值
-                            if isinstance(value, str):
-                                benchmark_returns[col] = pd.to_numeric(value.rstrip('%'), errors='coerce') / 100
-                            else:
-                                # 如果已经是数值类型，直接使用
-                                benchmark_returns[col] = pd.to_numeric(value, errors='coerce') / 100
-                    else:
-                        benchmark_returns[col] = 0
-                
-                # 计算超额收益率
-                for col in return_columns:
-                    if col in small_fund_df.columns:
-                        # 创建超额收益率列名
-                        excess_col = f'{col}超额'
-                        # 将原始收益率转换为数值
-                        small_fund_df[col] = pd.to_numeric(small_fund_df[col].astype(str).str.rstrip('%'), errors='coerce') / 100
-                        # 计算超额收益率（保持数值格式）
-                        small_fund_df[excess_col] = (small_fund_df[col] - benchmark_returns[col])*100
-                
-                # 只保留指定的列
-                columns_to_keep = ["基金代码", "基金简称", "日期", "近1周超额", "近1月超额", "近3月超额", "近6月超额", 
-                                  "近1年超额", "近2年超额", "近3年超额", "今年来超额", "成立时间", "最新规模", "市值评分", "换手率",
-                                   "前10大重仓股占比", "持股行业集中度"]
-                # 检查哪些列实际存在于DataFrame中
-                existing_columns = [col for col in columns_to_keep if col in small_fund_df.columns]
-                small_fund_df = small_fund_df[existing_columns]
-                
-                # 确保基金代码为6位，不足的向前填充0
-                if "基金代码" in small_fund_df.columns:
-                    small_fund_df["基金代码"] = small_fund_df["基金代码"].astype(str).str.zfill(6)
-                
-                # 保存带有超额收益率的数据，并应用样式
-                styled_df = small_fund_df.style.apply(highlight_excess_returns, axis=None)
-                styled_df.to_excel(writer, sheet_name='小微盘_超额', index=False)
-            else:
-                print(f"未找到小微盘基金的基准基金{benchmark_code}")
-        except Exception as e:
-            print(f"处理小微盘基金超额收益率时出错: {e}")
+            excess_sheets[f'{sheet_name}_超额'] = fund_df
     except Exception as e:
         print(f"计算超额收益率时出错: {e}")
+    return excess_sheets
 
-def adjust_column_width(filename):
-    """调整Excel文件的列宽"""
-    # 打开已存在的Excel文件
-    workbook = load_workbook(filename)
-    
-    for sheet_name in workbook.sheetnames:
-        worksheet = workbook[sheet_name]
-        for column in worksheet.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)  # 限制最大宽度为50
-            worksheet.column_dimensions[column_letter].width = adjusted_width
-    
-    workbook.save(filename)
+def save_excess_to_excel(writer, fund_df, sheet_name):
+    """保存带有超额收益率的数据，并应用样式"""
+    write_highlighted_sheet(writer, fund_df, sheet_name, EXCESS_HIGHLIGHT_COLUMNS)
 
-def update_fund_data():
-    """更新基金数据的函数"""
+def update_fund_data(cache=None):
+    """更新基金数据的函数
+    cache: 可选，外部共享的RunCache（如job_host中与main.py的任务共享），不提供时本次运行单独创建
+    返回是否成功完成（有基金类型处理失败或没有数据时返回False，定时任务不记录）
+    """
     print(f"开始更新基金数据: {time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
+        # 本次运行共享的缓存：同一只基金在各类型、各步骤中只抓取一次
+        if cache is None:
+            cache = RunCache()
+        
         # 先临时保存已筛选的基金数据（不包含市值评分）
         temp_data = {}
         filename = f'index-fund.xlsx'
         has_data = False
+        has_error = False
         
         # 先获取所有基金筛选结果，但不保存到Excel
         fund_types = ["沪深300", "中证500","A500","中证800", "中证1000", "中证2000","国证2000"]
         all_fund_codes = []
         
-        # 使用多线程并行处理不同类型的基金数据
-        print(f"开始并行处理 {len(fund_types)} 种指数基金和小微盘基金...")
+        print(f"开始处理 {len(fund_types)} 种指数基金和小微盘基金...")
         
-        def process_fund_type(fund_type):
-            """处理单个基金类型的函数"""
-            return fund_type, fetch_fund_data(fund_type)
+        # 全部基金排名数据只获取一次，各基金类型共享
+        rank_df = cache.get('rank_table', 'all', load_rank_table)
         
-        with ThreadPoolExecutor(max_workers=len(fund_types) + 1) as executor:
-            # 提交所有指数基金任务
-            futures = {executor.submit(process_fund_type, ft): ft for ft in fund_types}
-            # 提交小微盘基金任务
-            small_future = executor.submit(fetch_small_fund_data)
+        # 所有基金类型共享一个基金级任务队列：同一只基金只获取一次详情，
+        # 指数基金筛选完即开始获取详情，小微盘基金筛选完成后再加入队列
+        with ThreadPoolExecutor(max_workers=1) as small_executor, \
+                ThreadPoolExecutor(max_workers=ENRICH_MAX_WORKERS) as enrich_executor:
+            detail_futures = {}
+            
+            def enqueue(codes):
+                """把尚未提交的基金加入详情任务队列"""
+                for code in codes:
+                    code = str(code)
+                    if code not in detail_futures:
+                        detail_futures[code] = enrich_executor.submit(fetch_fund_detail, code, cache)
+            
+            # 小微盘基金需要扫描全部基金的风格数据，在后台筛选
+            small_future = small_executor.submit(fetch_small_fund_data, rank_df, False, cache)
             
-            # 处理指数基金结果
-            for future in as_completed(futures):
-                fund_type = futures[future]
+            # 指数基金直接在共享排名数据上筛选
+            for fund_type in fund_types:
                 try:
-                    _, fund_df = future.result()
+                    fund_df = fetch_fund_data(fund_type, rank_df, enrich=False)
                     if fund_df is not None and not fund_df.empty:
                         temp_data[f'{fund_type}基金'] = fund_df
-                        all_fund_codes.extend(fund_df['基金代码'].tolist())
-                        has_data = True
+                        enqueue(fund_df['基金代码'])
                 except Exception as e:
                     print(f"处理{fund_type}基金时出错: {e}")
+                    has_error = True
             
             # 处理小微盘基金结果
             try:
                 small_fund_df = small_future.result()
                 if small_fund_df is not None and not small_fund_df.empty:
                     temp_data['小微盘'] = small_fund_df
-                    all_fund_codes.extend(small_fund_df['基金代码'].tolist())
-                    has_data = True
+                    enqueue(small_fund_df['基金代码'])
             except Exception as e:
                 print(f"处理小微盘基金时出错: {e}")
+                has_error = True
+            
+            # 收集基金详情
+            details = {}
+            total_rows = sum(len(fund_df) for fund_df in temp_data.values())
+            print(f"共 {total_rows} 条基金记录，去重后 {len(detail_futures)} 只基金需要获取详情")
+            futures = {future: code for code, future in detail_futures.items()}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="获取基金详情"):
+                code = futures[future]
+                try:
+                    details[code] = future.result()
+                except Exception as e:
+                    print(f"基金代码{code}查询失败: {e}")
+        
+        for sheet_name, fund_df in temp_data.items():
+            apply_fund_details(fund_df, details)
+            all_fund_codes.extend(fund_df['基金代码'].tolist())
+            has_data = True
         
         # 收集所有需要市值评分的基金代码
         if all_fund_codes:
@@ -598,29 +563,32 @@ def update_fund_data():
             all_fund_codes = list(set(all_fund_codes))
             print(f'筛选出 {len(all_fund_codes)} 只基金，正在获取它们的市值评分...')
             
-            # 只针对这些基金获取市值评分
-            fund_list_df = get_fund_list(filter_types=['股票', '混合', '指数'])
-            fund_name_map = None
-            if 'code' in fund_list_df.columns and 'name' in fund_list_df.columns:
-                fund_name_map = dict(zip(fund_list_df['code'], fund_list_df['name']))
-            
-            # 批量获取市值评分
-            result_df, filtered_df = batch_get_style(all_fund_codes, fund_name_map=fund_name_map, max_workers=20, filter_market_cap_threshold=None)
+            # 小微盘扫描时已获取的风格数据直接复用，只对缓存中没有的基金获取市值评分
+            missing_codes = [code for code in all_fund_codes if not cache.contains('style', code)]
+            if missing_codes:
+                print(f'其中 {len(missing_codes)} 只基金不在缓存中，正在获取...')
+                fund_list_df = get_fund_list(filter_types=EQUITY_FUND_TYPES)
+                fund_name_map = None
+                if 'code' in fund_list_df.columns and 'name' in fund_list_df.columns:
+                    fund_name_map = dict(zip(fund_list_df['code'], fund_list_df['name']))
+                
+                # 批量获取市值评分
+                failed_codes = []
+                result_df, filtered_df = batch_get_style(missing_codes, fund_name_map=fund_name_map, max_workers=20,
+                                                         filter_market_cap_threshold=None, failed_codes=failed_codes)
+                seed_style_rows(cache, set(missing_codes) - set(failed_codes), result_df)
             
             # 创建基金代码到市值评分的映射
             market_cap_map = {}
-            if result_df is not None and not result_df.empty:
-                if '市值_本基金' in result_df.columns:
-                    market_cap_map = dict(zip(result_df['基金代码'], result_df['市值_本基金']))
-                print(f'获取到 {len(market_cap_map)} 只基金的市值评分')
+            for code in all_fund_codes:
+                style_row = cache.peek('style', code)
+                if style_row and '市值_本基金' in style_row:
+                    market_cap_map[str(code)] = style_row['市值_本基金']
+            print(f'获取到 {len(market_cap_map)} 只基金的市值评分')
             
             # 给每个基金DataFrame添加市值评分
             for sheet_name, fund_df in temp_data.items():
-                fund_df.loc[:, "市值评分"] = ""
-                for idx, row in fund_df.iterrows():
-                    code = str(row["基金代码"])
-                    if code in market_cap_map:
-                        fund_df.loc[idx, "市值评分"] = market_cap_map[code]
+                fund_df.loc[:, "市值评分"] = fund_df["基金代码"].astype(str).map(market_cap_map).fillna("").values
                 
                 # 重新排列列顺序
                 cols = list(fund_df.columns)
@@ -631,32 +599,37 @@ def update_fund_data():
                         cols.insert(latest_scale_idx + 1, "市值评分")
                         temp_data[sheet_name] = fund_df[cols]
         
-        # 现在保存到Excel
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+        # 超额收益率直接由内存中的数据计算
+        excess_sheets = calculate_excess_returns(temp_data, rank_df) if has_data else {}
+        
+        # 所有工作表一次写入Excel，列宽在保存前调整
+        with pd.ExcelWriter(filename, engine=EXCEL_ENGINE) as writer:
             for sheet_name, fund_df in temp_data.items():
                 save_to_excel(writer, fund_df, sheet_name)
-        
-        # 只有当有数据时才继续处理
-        if has_data:
-            # 计算超额收益率并保存到新的工作表
-            with pd.ExcelWriter(filename, engine='openpyxl', mode='a') as writer:
-                calculate_excess_returns(writer)
+            for sheet_name, fund_df in excess_sheets.items():
+                save_excess_to_excel(writer, fund_df, sheet_name)
             
-            # 调整列宽
+            # 根据DataFrame内容设置列宽
             try:
-                adjust_column_width(filename)
+                for sheet_name, fund_df in {**temp_data, **excess_sheets}.items():
+                    if sheet_name in writer.sheets:
+                        set_column_widths(writer, sheet_name, compute_column_widths(fund_df))
             except Exception as e:
                 print(f"调整列宽时出错: {e}")
-            
+        
+        # 只有当有数据时才继续处理
+        if has_data:
             print(f"已将所有C份额基金的排序结果保存为'{filename}'，每个时间段的前10名标黄，至少有4个时间段进入前10的基金其简称标金黄色。")
         else:
             print("没有获取到任何基金数据")
         
         print(f"基金数据更新完成: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        return has_data and not has_error
     except Exception as e:
         print(f"更新基金数据时发生错误: {e}")
         import traceback
         traceback.print_exc()
+        return False
 
 def run_scheduler():
     """运行定时任务"""
@@ -670,13 +643,13 @@ def run_scheduler():
 
 def start_scheduler():
     """启动定时任务"""
-    # 立即执行一次更新
-    update_fund_data()
+    # 立即执行一次更新（上一个交易日的数据已处理过则跳过）
+    run_if_new_trading_data(INDEX_RANK_JOB, update_fund_data)
     
-    # 设置每天凌晨12:00执行更新
-    schedule.every().day.at("00:00").do(update_fund_data)
+    # 设置每天凌晨12:00检查，只有出现新的交易日数据时才更新
+    schedule.every().day.at("00:00").do(run_if_new_trading_data, INDEX_RANK_JOB, update_fund_data)
     
-    print("定时任务已启动，每天凌晨12:00将自动更新数据。")
+    print("定时任务已启动，每天凌晨12:00检查，有新的交易日数据时自动更新。")
     print("按 Ctrl+C 可以停止程序。")
     
     # 在单独的线程中运行定时任务
@@ -0,0 +1,61 @@
+import pandas as pd
+from openpyxl.styles import Alignment
+from openpyxl.utils import get_column_letter
+
+try:
+    import xlsxwriter  # noqa: F401
+    XLSXWRITER_AVAILABLE = True
+except ImportError:
+    XLSXWRITER_AVAILABLE = False
+
+# 导出Excel使用的引擎：优先使用流式写入的xlsxwriter，未安装时回退到openpyxl
+EXCEL_ENGINE = 'xlsxwriter' if XLSXWRITER_AVAILABLE else 'openpyxl'
+
+# 中文字符按1.5个宽度计算，更贴近Excel实际显示
+CJK_CHAR_WIDTH = 1.5
+CJK_PATTERN = r'[\u4e00-\u9fff]'
+
+
+def text_widths(values):
+    """向量化计算一列文本的显示宽度（中文字符按CJK_CHAR_WIDTH计）"""
+    text = values.fillna('').astype(str)
+    return text.str.len() + text.str.count(CJK_PATTERN) * (CJK_CHAR_WIDTH - 1)
+
+
+def compute_column_widths(df, padding=2, max_width=50, min_width=None):
+    """根据DataFrame内容（含表头）计算各列列宽，返回与df.columns顺序一致的列表
+    min_width: 可选，接收列名、返回该列最小列宽的函数
+    """
+    header_widths = text_widths(pd.Series(df.columns.astype(str), index=df.columns))
+    if df.empty:
+        content_widths = pd.Series(0, index=df.columns)
+    else:
+        content_widths = df.apply(text_widths).max().fillna(0)
+    widths = []
+    for col, header_width, content_width in zip(df.columns, header_widths, content_widths):
+        width = max(header_width, content_width) + padding
+        if min_width is not None:
+            width = max(width, min_width(col))
+        widths.append(min(width, max_width))
+    return widths
+
+
+def set_column_widths(writer, sheet_name, widths, center=False):
+    """在写入时设置列宽（不需要保存后重新加载工作簿）
+    center: 是否设置单元格水平、垂直居中
+    """
+    worksheet = writer.sheets[sheet_name]
+    if writer.engine == 'xlsxwriter':
+        cell_format = writer.book.add_format({'align': 'center', 'valign': 'vcenter'}) if center else None
+        for col_idx, width in enumerate(widths):
+            worksheet.set_column(col_idx, col_idx, width, cell_format)
+        return
+
+    for col_idx, width in enumerate(widths):
+        worksheet.column_dimensions[get_column_letter(col_idx + 1)].width = width
+    if center:
+        # openpyxl没有列级格式，只能在写入后逐个单元格设置
+        alignment = Alignment(horizontal='center', vertical='center')
+        for row in worksheet.iter_rows():
+            for cell in row:
+                cell.alignment = alignment
@@ -5,9 +5,12 @@ import pandas as pd
 from typing import Dict, List, Optional, Tuple
 import akshare as ak
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 from fund_search_parser import fetch_and_parse_fund_search
+from jiuquaner_fund_style import strip_share_class_suffix
+from trading_calendar import is_quarterly_data_stale
 
 
 def get_fund_name_by_code(fund_code: str) -> Optional[str]:
@@ -68,9 +71,7 @@ def find_a_c_classes(fund_name: str) -> Tuple[Optional[str], Optional[str]]:
         tuple: (A类基金名称, C类基金名称)，如果未找到则对应位置为None
     """
     # 移除可能的A类或C类后缀
-    base_name = fund_name
-    if fund_name.endswith('A') or fund_name.endswith('C'):
-        base_name = fund_name[:-1]
+    base_name = strip_share_class_suffix(fund_name)
     
     # 构造A类和C类基金名称
     a_class_name = base_name + 'A' if not base_name.endswith('A') else base_name
@@ -417,6 +418,90 @@ def aggregate_fund_cyrjg_data(cyrjg_data_list: List[Dict]) -> List[Dict]:
     return result[:5]
 
 
+def aggregate_share_class_data(share_classes: Dict[str, List[Dict]], scale_results: Dict[str, Dict],
+                               cyrjg_results: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    按 (目标基金, 日期) 一次分组汇总所有基金的规模和持有人结构数据
+
+    Args:
+        share_classes (dict): 目标基金代码 -> 份额列表 [{'code': ..., 'name': ...}]
+        scale_results (dict): 份额代码 -> crawl_fund_scale_data 的结果
+        cyrjg_results (dict): 份额代码 -> crawl_fund_cyrjg_data 的结果
+
+    Returns:
+        dict: 目标基金代码 -> {'规模数据': [...], '持有人结构': [...]}，结构与
+              aggregate_fund_scale_data / aggregate_fund_cyrjg_data 的返回值一致
+    """
+    scale_rows = []
+    cyrjg_rows = []
+    for target_code, classes in share_classes.items():
+        for share_class in classes:
+            class_code = share_class['code']
+            class_name = share_class.get('name') or '未知'
+            scale_data = scale_results.get(class_code) or {}
+            if scale_data.get('status') == 'success' and scale_data.get('data'):
+                for item in scale_data['data']:
+                    scale_rows.append({
+                        '目标基金': target_code,
+                        '日期': item['日期'],
+                        '基金代码': class_code,
+                        '基金名称': class_name,
+                        '期末净资产': item['期末净资产'] or 0
+                    })
+            cyrjg_data = cyrjg_results.get(class_code) or {}
+            if cyrjg_data.get('status') == 'success' and cyrjg_data.get('data'):
+                for item in cyrjg_data['data']:
+                    cyrjg_rows.append({
+                        '目标基金': target_code,
+                        '日期': item['日期'],
+                        '基金代码': class_code,
+                        '基金名称': class_name,
+                        '机构持有比例': item['机构持有比例'],
+                        '总份额（亿份）': item['总份额（亿份）']
+                    })
+
+    result = {code: {'规模数据': [], '持有人结构': []} for code in share_classes}
+
+    if scale_rows:
+        scale_df = pd.DataFrame(scale_rows)
+        scale_df['期末净资产'] = pd.to_numeric(scale_df['期末净资产'], errors='coerce').fillna(0).round(2)
+        for (target_code, date), group in scale_df.groupby(['目标基金', '日期'], sort=False):
+            result[target_code]['规模数据'].append({
+                '日期': date,
+                '期末净资产': round(float(group['期末净资产'].sum()), 2),
+                '基金明细': group[['基金代码', '基金名称', '期末净资产']].to_dict('records')
+            })
+
+    if cyrjg_rows:
+        cyrjg_df = pd.DataFrame(cyrjg_rows)
+        # 无法转换的值（如'---'）视为0
+        ratio = pd.to_numeric(cyrjg_df['机构持有比例'].astype(str).str.rstrip('%'), errors='coerce').fillna(0)
+        shares = pd.to_numeric(cyrjg_df['总份额（亿份）'], errors='coerce').fillna(0)
+        cyrjg_df['_份额'] = shares
+        cyrjg_df['_加权比例'] = ratio * shares
+        cyrjg_df['_比例'] = ratio
+        for (target_code, date), group in cyrjg_df.groupby(['目标基金', '日期'], sort=False):
+            total_shares = group['_份额'].sum()
+            # 按总份额加权平均机构持有比例，总份额为0时使用最后一条的比例
+            if total_shares > 0:
+                institution_ratio = group['_加权比例'].sum() / total_shares
+            else:
+                institution_ratio = group['_比例'].iloc[-1]
+            result[target_code]['持有人结构'].append({
+                '日期': date,
+                '机构持有比例': f"{institution_ratio:.2f}%",
+                '总份额（亿份）': round(float(total_shares), 2),
+                '基金明细': group[['基金代码', '基金名称', '机构持有比例', '总份额（亿份）']].to_dict('records')
+            })
+
+    # 按日期倒序，只保留前5条记录
+    for aggregated in result.values():
+        for key in ('规模数据', '持有人结构'):
+            aggregated[key].sort(key=lambda x: x['日期'], reverse=True)
+            aggregated[key] = aggregated[key][:5]
+    return result
+
+
 def update_fund_data_json(target_fund_code: str, target_fund_name: str, 
                          aggregated_scale_data: List[Dict], aggregated_cyrjg_data: List[Dict]):
     """
@@ -455,6 +540,208 @@ def update_fund_data_json(target_fund_code: str, target_fund_name: str,
     print(f"已更新基金 {target_fund_code} 的数据到 {fund_data_file}")
 
 
+def apply_fund_data_updates(fund_data: Dict, updates: Dict[str, Dict]) -> Dict:
+    """
+    把规模和持有人结构数据合并到已加载的fund_data中（不写文件），并记录更新时间
+    """
+    update_time = datetime.now().strftime('%Y-%m-%d')
+    for fund_code, update in updates.items():
+        fund_data.setdefault(fund_code, {}).update(dict(update, 更新时间=update_time))
+    return fund_data
+
+
+def update_fund_data_json_batch(updates: Dict[str, Dict]):
+    """
+    批量更新基金数据到JSON文件，只读写一次文件
+
+    Args:
+        updates (dict): 基金代码 -> {'基金名称': ..., '规模数据': [...], '持有人结构': [...]}
+    """
+    if not updates:
+        return
+    fund_data_file = 'fund_data.json'
+
+    # 读取现有数据
+    if os.path.exists(fund_data_file):
+        with open(fund_data_file, 'r', encoding='utf-8') as f:
+            fund_data = json.load(f)
+    else:
+        fund_data = {}
+
+    apply_fund_data_updates(fund_data, updates)
+
+    # 写入文件
+    with open(fund_data_file, 'w', encoding='utf-8') as f:
+        json.dump(fund_data, f, ensure_ascii=False, indent=2)
+
+    print(f"已更新 {len(updates)} 只基金的数据到 {fund_data_file}")
+
+
+def is_fund_data_fresh(fund_info: Dict, cache_days: int) -> bool:
+    """
+    判断基金的规模/持有人结构数据是否仍在缓存有效期内
+    除了cache_days的上限外，上次更新后又进入定期报告披露期的数据也视为过期
+    """
+    update_time_str = fund_info.get('更新时间') if isinstance(fund_info, dict) else None
+    if not update_time_str:
+        return False
+    try:
+        update_time = datetime.strptime(update_time_str, '%Y-%m-%d')
+    except ValueError:
+        return False
+    return datetime.now() - update_time < timedelta(days=cache_days) and not is_quarterly_data_stale(update_time)
+
+
+def _resolve_share_classes(fund_code: str) -> Tuple[Optional[str], List[Dict]]:
+    """
+    查找基金名称及其全部份额（A+C）
+    """
+    fund_name = get_fund_name_by_code(fund_code)
+    if not fund_name:
+        return None, []
+    base_name = strip_share_class_suffix(fund_name)
+    code_names = fetch_and_parse_fund_search(base_name)
+    if not isinstance(code_names, list):
+        return fund_name, []
+    return fund_name, [item for item in code_names if isinstance(item, dict) and item.get('code')]
+
+
+def collect_fund_data_batch(fund_codes: List[str], max_workers: int = 10) -> Dict[str, Dict]:
+    """
+    批量获取多只基金的规模和持有人结构数据
+
+    先并发展开所有基金的份额，再对全部份额并发抓取 gmbd 和 cyrjg 数据，
+    最后一次分组汇总。
+
+    Args:
+        fund_codes (list): 目标基金代码列表
+        max_workers (int): 并发线程数
+
+    Returns:
+        dict: 基金代码 -> {'基金名称': ..., '规模数据': [...], '持有人结构': [...]}
+    """
+    fund_codes = list(dict.fromkeys(fund_codes))
+    if not fund_codes:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 1. 并发查找基金名称和对应的份额(A+C)
+        resolved = dict(zip(fund_codes, executor.map(_resolve_share_classes, fund_codes)))
+        fund_names = {}
+        share_classes = {}
+        for fund_code, (fund_name, classes) in resolved.items():
+            if not fund_name:
+                print(f"无法获取基金 {fund_code} 的名称")
+                continue
+            fund_names[fund_code] = fund_name
+            share_classes[fund_code] = classes
+
+        # 2. 所有份额的规模数据和持有人结构数据一起并发抓取
+        class_codes = list(dict.fromkeys(c['code'] for classes in share_classes.values() for c in classes))
+        print(f"正在并发获取 {len(share_classes)} 只基金共 {len(class_codes)} 个份额的规模和持有人结构数据...")
+        scale_futures = {code: executor.submit(crawl_fund_scale_data, code) for code in class_codes}
+        cyrjg_futures = {code: executor.submit(crawl_fund_cyrjg_data, code) for code in class_codes}
+        scale_results = {code: future.result() for code, future in scale_futures.items()}
+        cyrjg_results = {code: future.result() for code, future in cyrjg_futures.items()}
+
+    # 3. 一次分组汇总
+    aggregated = aggregate_share_class_data(share_classes, scale_results, cyrjg_results)
+
+    results = {}
+    for fund_code, data in aggregated.items():
+        if not data['规模数据']:
+            print(f"未能获取基金 {fund_code} 有效的基金规模数据")
+            continue
+        results[fund_code] = {
+            '基金名称': fund_names[fund_code],
+            '规模数据': data['规模数据'],
+            '持有人结构': data['持有人结构']
+        }
+    return results
+
+
+def load_fund_data_store(fund_data_file: str = 'fund_data.json') -> Dict:
+    """
+    读取fund_data.json，文件不存在或读取失败时返回空字典
+    """
+    if not os.path.exists(fund_data_file):
+        return {}
+    try:
+        with open(fund_data_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取缓存数据时出错: {e}")
+        return {}
+
+
+def plan_fund_data_refresh(fund_codes: List[str], cache_days: int = 90,
+                           fund_data: Optional[Dict] = None) -> Tuple[List[str], List[str]]:
+    """
+    按缓存有效期把基金划分为无需更新和需要更新两组，整个存储只加载一次
+
+    Args:
+        fund_codes (list): 基金代码列表
+        cache_days (int): 缓存天数，默认90天（约一个季度）
+        fund_data (dict, optional): 已加载的fund_data.json内容，不提供时从文件读取
+
+    Returns:
+        tuple: (缓存有效的基金代码列表, 需要更新的基金代码列表)
+    """
+    if fund_data is None:
+        fund_data = load_fund_data_store()
+    fresh_codes = []
+    stale_codes = []
+    for fund_code in dict.fromkeys(fund_codes):
+        if is_fund_data_fresh(fund_data.get(fund_code), cache_days):
+            fresh_codes.append(fund_code)
+        else:
+            stale_codes.append(fund_code)
+    return fresh_codes, stale_codes
+
+
+def process_fund_data_batch(fund_codes: List[str], cache_days: Optional[int] = 90, max_workers: int = 10,
+                            fund_data: Optional[Dict] = None):
+    """
+    批量处理基金数据：并发抓取、汇总后一次写入fund_data.json
+
+    Args:
+        fund_codes (list): 基金代码列表
+        cache_days (int): 缓存天数，默认90天；为None时全部重新获取
+        max_workers (int): 并发线程数
+        fund_data (dict, optional): 已加载的fund_data.json内容，用于判断缓存是否有效
+    """
+    results = compute_fund_data_batch(fund_codes, cache_days, max_workers, fund_data)
+    update_fund_data_json_batch(results)
+    return results
+
+
+def compute_fund_data_batch(fund_codes: List[str], cache_days: Optional[int] = 90, max_workers: int = 10,
+                            fund_data: Optional[Dict] = None) -> Dict[str, Dict]:
+    """
+    批量获取过期基金的规模和持有人结构数据，只返回结果不写文件（由调用方统一合并写入）
+
+    Args:
+        fund_codes (list): 基金代码列表
+        cache_days (int): 缓存天数，默认90天；为None时全部重新获取
+        max_workers (int): 并发线程数
+        fund_data (dict, optional): 已加载的fund_data.json内容，用于判断缓存是否有效
+    """
+    if cache_days is not None:
+        fresh_codes, fund_codes = plan_fund_data_refresh(fund_codes, cache_days, fund_data)
+        if fresh_codes:
+            print(f"{len(fresh_codes)} 只基金的数据在 {cache_days} 天内已更新，使用缓存数据")
+
+    if not fund_codes:
+        return {}
+    print(f"{len(fund_codes)} 只基金需要更新数据...")
+    results = collect_fund_data_batch(fund_codes, max_workers=max_workers)
+    for fund_code, data in results.items():
+        print(f"基金 {fund_code}({data['基金名称']}) 聚合后的规模数据:")
+        for item in data['规模数据']:
+            print(f"  日期: {item['日期']}, 期末净资产: {item['期末净资产']} 亿元")
+    return results
+
+
 def process_fund_data(original_fund_code: str):
     """
     处理基金数据的完整流程
@@ -471,9 +758,7 @@ def process_fund_data(original_fund_code: str):
         return
     
     print(f"基金名称: {fund_name}")
-    base_name = fund_name
-    if fund_name.endswith('A') or fund_name.endswith('C'):
-        base_name = fund_name[:-1]
+    base_name = strip_share_class_suffix(fund_name)
     # 2. 根据基金名称查找对应的基金代码(A+C)
     # [{'code': '015381', 'name': '东方兴瑞趋势领航混合A'}, {'code': '015382', 'name': '东方兴瑞趋势领航混合C'}]
     code_names = fetch_and_parse_fund_search(base_name)
@@ -520,25 +805,11 @@ def process_fund_data_with_cache(original_fund_code: str, cache_days: int = 90):
     """
     print(f"开始处理基金代码: {original_fund_code}")
     
-    # 检查是否有缓存数据且未过期
-    fund_data_file = 'fund_data.json'
-    if os.path.exists(fund_data_file):
-        try:
-            with open(fund_data_file, 'r', encoding='utf-8') as f:
-                all_fund_data = json.load(f)
-                
-            if original_fund_code in all_fund_data:
-                fund_info = all_fund_data[original_fund_code]
-                # 检查更新时间
-                if '更新时间' in fund_info:
-                    update_time_str = fund_info['更新时间']
-                    update_time = datetime.strptime(update_time_str, '%Y-%m-%d')
-                    # 如果距离现在不到cache_days天，则使用缓存数据
-                    if datetime.now() - update_time < timedelta(days=cache_days):
-                        print(f"基金 {original_fund_code} 的数据在 {cache_days} 天内已更新，使用缓存数据")
-                        return
-        except Exception as e:
-            print(f"读取缓存数据时出错: {e}")
+    # 检查是否有缓存数据且未过期，如果距离上次更新不到cache_days天，则使用缓存数据
+    fresh_codes, _ = plan_fund_data_refresh([original_fund_code], cache_days)
+    if fresh_codes:
+        print(f"基金 {original_fund_code} 的数据在 {cache_days} 天内已更新，使用缓存数据")
+        return
     
     # 如果没有缓存或者缓存已过期，则执行完整流程
     print(f"基金 {original_fund_code} 需要更新数据...")
@@ -550,9 +821,7 @@ def process_fund_data_with_cache(original_fund_code: str, cache_days: int = 90):
         return
     
     print(f"基金名称: {fund_name}")
-    base_name = fund_name
-    if fund_name.endswith('A') or fund_name.endswith('C'):
-        base_name = fund_name[:-1]
+    base_name = strip_share_class_suffix(fund_name)
     # 2. 根据基金名称查找对应的基金代码(A+C)
     # [{'code': '015381', 'name': '东方兴瑞趋势领航混合A'}, {'code': '015382', 'name': '东方兴瑞趋势领航混合C'}]
     code_names = fetch_and_parse_fund_search(base_name)
@@ -12,6 +12,7 @@ import gzip
 import zlib
 import brotli
 import akshare as ak
+from concurrent.futures import ThreadPoolExecutor
 
 # 基金规模：https://apiv2.jiucaishuo.com/funddetail/detail/fund-scale-change
 # 资产分布：https://api.jiucaishuo.com/fundetail/fund-position/fundinvest
@@ -77,9 +78,10 @@ def get_industry_concentration_from_akshare(fund_code):
         # print(f"AKShare获取基金 {fund_code} 行业集中度失败: {e}")
         return None
 
-def create_session():
+def create_session(pool_maxsize=10):
     """
     创建一个带有重试策略的会话
+    pool_maxsize: 连接池大小，多线程共用一个会话时应不小于线程数
     """
     session = requests.Session()
 
@@ -91,7 +93,7 @@ def create_session():
     )
 
     # 创建适配器并挂载到会话
-    adapter = HTTPAdapter(max_retries=retry_strategy)
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
 
@@ -135,9 +137,10 @@ def extract_numeric_value(text):
     return text
 
 
-def parse_fund_data(fund_code):
+def parse_fund_data(fund_code, session=None):
     """
     调用API接口并解析基金数据
+    session: 可选，共享的会话（批量获取时复用连接），不提供时新建
     """
     url = "https://apiv2.jiucaishuo.com/funddetail/detail/fund-high-lights"
     payload = {
@@ -146,7 +149,8 @@ def parse_fund_data(fund_code):
     }
 
     # 创建会话
-    session = create_session()
+    if session is None:
+        session = create_session()
 
     try:
         response = session.post(url, json=payload, headers=HEADER_JIUQUAN, timeout=15, stream=True)
@@ -208,6 +212,27 @@ def parse_fund_data(fund_code):
         return None
 
 
+def parse_fund_data_batch(fund_codes, max_workers=10):
+    """
+    并发获取多只基金的数据，所有请求共用一个会话
+
+    返回
+    ------
+    dict
+        基金代码 -> parse_fund_data 的结果（获取失败为None）
+    """
+    fund_codes = list(dict.fromkeys(fund_codes))
+    if not fund_codes:
+        return {}
+    session = create_session(pool_maxsize=max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda code: parse_fund_data(code, session=session), fund_codes)
+            return dict(zip(fund_codes, results))
+    finally:
+        session.close()
+
+
 def parse_fund_details(data, fund_code):
     """
     解析基金详细信息
@@ -4,10 +4,19 @@ import json
 import time
 import gzip
 import re
+import os
+import glob
+from itertools import islice
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from threading import Lock
 
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
 HEADER_JIUQUAN = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Content-Type': 'application/json',
@@ -15,6 +24,64 @@ HEADER_JIUQUAN = {
     'Origin': 'https://www.funddb.cn'
 }
 
+# 基金列表（天天基金 fundcode_search.js）的本地缓存，每天最多刷新一次
+FUND_UNIVERSE_FILE = 'fund_universe.parquet'
+
+# 常用的基金类型关键词
+EQUITY_FUND_TYPES = ['股票', '混合', '指数']
+
+# 扫描风格数据前排除的基金名称关键词（债券、定开、货币等）
+FUND_NAME_EXCLUDE_PATTERN = '债券|定开|货币|人民币|美元|300|500|定期|纯债|A50|持有|黄金|A'
+
+# 进程内的基金列表缓存：(日期, DataFrame)
+_fund_universe = None
+_fund_universe_lock = Lock()
+
+# 流式扫描结果的保存目录（按日期分子目录）
+STYLE_SCAN_DIR = 'fund_style_scan'
+
+# 流式扫描时每个分片文件写入的基金数
+SCAN_CHUNK_SIZE = 500
+
+# 份额后缀：名称以A/B/C/D/E/F结尾时，去掉末尾连续的份额字母和空格
+SHARE_CLASS_TAIL_PATTERN = re.compile(r'[ABCDEF]$')
+SHARE_CLASS_TAIL_STRIP_PATTERN = re.compile(r'[ ABCDEF]+$')
+# 名称中间的份额标识（如"XX混合A类 YY"）
+SHARE_CLASS_INFIX_PATTERN = re.compile(r'^(.*?)(?:A|C|A类|C类)(?:$|\s)')
+# C类份额
+C_CLASS_PATTERN = re.compile(r'C$|C类| C')
+
+
+def strip_share_class_suffix(fund_name):
+    """去掉基金名称末尾的A/C份额后缀，用于按基础名称搜索同一基金的全部份额"""
+    if fund_name.endswith('A') or fund_name.endswith('C'):
+        return fund_name[:-1]
+    return fund_name
+
+def share_class_base_names(names):
+    """向量化计算基金基础名称（去掉A/B/C/D/E/F等份额标识），names为基金名称Series"""
+    names = names.astype(str).str.strip()
+    has_tail = names.str.contains(SHARE_CLASS_TAIL_PATTERN)
+    tail_stripped = names.str.replace(SHARE_CLASS_TAIL_STRIP_PATTERN, '', regex=True)
+    infix_stripped = names.str.extract(SHARE_CLASS_INFIX_PATTERN)[0].str.rstrip()
+    return tail_stripped.where(has_tail, infix_stripped.fillna(names))
+
+def prefer_c_share_class(df, name_column='基金名称'):
+    """处理A/C类基金：同一基础名称下如果有C类，只保留C类；没有C类则全部保留"""
+    if df.empty:
+        return df
+    
+    base_names = share_class_base_names(df[name_column])
+    is_c = df[name_column].str.contains(C_CLASS_PATTERN, na=False)
+    group_has_c = is_c.groupby(base_names).transform('any')
+    keep = is_c | ~group_has_c
+    
+    removed = df.loc[~keep, name_column]
+    for base_name, a_names in removed.groupby(base_names[~keep]):
+        print(f'  - 同时有A/C类，保留C类，移除: {a_names.tolist()}')
+    
+    return df[keep].copy()
+
 def create_session():
     session = requests.Session()
     session.headers.update(HEADER_JIUQUAN)
@@ -32,6 +99,8 @@ def decompress_response_content(response):
 def get_fund_style_data(fund_code):
     """
     获取基金持股风格数据
+    接口返回没有风格数据时返回None；请求失败（超时、连接错误、返回内容无法解析）时抛出异常，
+    以便与"没有数据"区分，扫描时失败的基金不会被记为已扫描
     """
     url = "https://api.jiucaishuo.com/fundetail/fund-position/fundinvest"
     payload = {
@@ -44,7 +113,7 @@ def get_fund_style_data(fund_code):
     session = requests.Session()
     session.headers.update(HEADER_JIUQUAN)
     
-    try:
+    with session:
         response = session.post(url, json=payload, timeout=10)
         response.raise_for_status()
         
@@ -61,10 +130,10 @@ def get_fund_style_data(fund_code):
         text = text.strip()
         
         if not text:
-            return None
+            raise ValueError(f'基金 {fund_code} 风格数据接口返回空内容')
             
         if not (text.startswith('{') or text.startswith('[')):
-            return None
+            raise ValueError(f'基金 {fund_code} 风格数据接口返回非JSON内容: {text[:100]}')
             
         data = json.loads(text)
         
@@ -84,13 +153,8 @@ def get_fund_style_data(fund_code):
             return style_data
         return None
 
-    except Exception:
-        return None
-
-def get_fund_list(filter_types=None):
-    """获取天天基金的基金列表
-    filter_types: 可选，只保留指定类型的基金，如 ['股票', '混合', '指数']
-    """
+def download_fund_universe():
+    """下载并解析天天基金的基金列表，type列为分类类型"""
     url = 'http://fund.eastmoney.com/js/fundcode_search.js'
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -119,84 +183,261 @@ def get_fund_list(filter_types=None):
     # 打印所有基金类型
     if 'type' in df.columns:
         print(f'基金类型示例: {df["type"].unique()[:10]}\n')
+        df['type'] = df['type'].astype('category')
+    
+    return df
+
+def load_fund_universe():
+    """获取基金列表：优先使用进程内缓存，其次使用当天的本地parquet缓存，都没有时重新下载"""
+    global _fund_universe
+    today = datetime.now().date()
+    with _fund_universe_lock:
+        if _fund_universe is not None and _fund_universe[0] == today:
+            return _fund_universe[1]
+        
+        df = None
+        if PARQUET_AVAILABLE and os.path.exists(FUND_UNIVERSE_FILE):
+            modified = datetime.fromtimestamp(os.path.getmtime(FUND_UNIVERSE_FILE)).date()
+            if modified == today:
+                try:
+                    df = pd.read_parquet(FUND_UNIVERSE_FILE)
+                    print(f'从本地缓存加载基金列表: {len(df)} 只基金')
+                except Exception as e:
+                    print(f'读取基金列表缓存失败: {e}')
         
-        # 筛选指定类型 - 使用关键词匹配（因为类型是"混合型-灵活"这种格式）
-        if filter_types:
-            print(f'筛选基金类型关键词: {filter_types}')
-            mask = df['type'].str.contains('|'.join(filter_types), na=False)
-            df = df[mask].copy()
-            print(f'筛选后剩余 {len(df)} 只基金\n')
+        if df is None:
+            df = download_fund_universe()
+            if PARQUET_AVAILABLE:
+                try:
+                    df.to_parquet(FUND_UNIVERSE_FILE, index=False)
+                except Exception as e:
+                    print(f'保存基金列表缓存失败: {e}')
+        
+        _fund_universe = (today, df)
+        return df
+
+def fund_type_mask(df, filter_types):
+    """基金类型关键词掩码：先在type的分类中匹配关键词，再按分类筛选（类型是"混合型-灵活"这种格式）"""
+    types = df['type']
+    if isinstance(types.dtype, pd.CategoricalDtype):
+        categories = pd.Series(types.cat.categories)
+        matched = categories[categories.str.contains('|'.join(filter_types), na=False)]
+        return types.isin(matched)
+    return types.str.contains('|'.join(filter_types), na=False)
+
+def name_exclude_mask(df, pattern=FUND_NAME_EXCLUDE_PATTERN):
+    """基金名称排除掩码：名称不含排除关键词的基金为True"""
+    return ~df['name'].str.contains(pattern, na=False)
+
+def get_fund_list(filter_types=None):
+    """获取天天基金的基金列表（每天最多下载一次）
+    filter_types: 可选，只保留指定类型的基金，如 ['股票', '混合', '指数']
+    """
+    df = load_fund_universe()
     
+    if filter_types and 'type' in df.columns:
+        print(f'筛选基金类型关键词: {filter_types}')
+        df = df[fund_type_mask(df, filter_types)]
+        print(f'筛选后剩余 {len(df)} 只基金\n')
+    
+    return df.copy()
+
+def iter_style(fund_codes, max_workers=10, max_in_flight=None):
+    """以生成器方式批量获取基金风格数据，按完成顺序产出 (基金代码, 结果)
+    结果为风格数据字典、None（没有风格数据）或请求失败时的异常对象
+    同时在途的请求数不超过max_in_flight（默认为并发数的4倍），内存占用不随基金数量增长
+    """
+    if max_in_flight is None:
+        max_in_flight = max_workers * 4
+    codes = iter(fund_codes)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(get_fund_style_data, code): code for code in islice(codes, max_in_flight)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                code = pending.pop(future)
+                try:
+                    style = future.result()
+                except Exception as e:
+                    style = e
+                yield code, style
+                for next_code in islice(codes, 1):
+                    pending[executor.submit(get_fund_style_data, next_code)] = next_code
+
+def is_zero_market_cap(market_cap_score):
+    """市值评分是否为0（为0的基金没有有效的风格数据）"""
+    return market_cap_score is not None and str(market_cap_score).strip() in ['0', '0.0', '0.00']
+
+def order_style_columns(df):
+    """调整列顺序，把基金名称放在第二列"""
+    if not df.empty and '基金名称' in df.columns:
+        cols = ['基金代码', '基金名称'] + [col for col in df.columns if col not in ['基金代码', '基金名称']]
+        df = df[cols]
     return df
 
-def batch_get_style(fund_codes, fund_name_map=None, max_workers=10, filter_market_cap_threshold=None):
+def batch_get_style(fund_codes, fund_name_map=None, max_workers=10, filter_market_cap_threshold=None, failed_codes=None):
     """批量获取基金风格评分（多线程版）
     fund_name_map: 基金代码->名称的字典
     max_workers: 并发线程数，默认10
+    failed_codes: 可选，传入列表时把请求失败的基金代码加入其中
     """
     results = []
     filtered_results = []
     total = len(fund_codes)
-    lock = Lock()
     success_count = 0
     
     print(f'开始多线程获取，并发数: {max_workers}\n')
     
-    def fetch_fund(code):
-        nonlocal success_count
+    for code, style in iter_style(fund_codes, max_workers=max_workers):
+        if isinstance(style, Exception):
+            if failed_codes is not None:
+                failed_codes.append(code)
+            continue
+        if not style:
+            continue
+        # 添加基金名称
+        if fund_name_map and code in fund_name_map:
+            style['基金名称'] = fund_name_map[code]
+        
+        # 检查市值是否为0，为0则跳过
+        market_cap_score = style.get('市值_本基金')
+        if is_zero_market_cap(market_cap_score):
+            continue
+        
+        results.append(style)
+        success_count += 1
+        
         try:
-            style = get_fund_style_data(code)
-            if style:
-                # 添加基金名称
-                if fund_name_map and code in fund_name_map:
-                    style['基金名称'] = fund_name_map[code]
-                
-                # 检查市值是否为0，为0则跳过
-                market_cap_score = style.get('市值_本基金')
-                if market_cap_score is not None and str(market_cap_score).strip() in ['0', '0.0', '0.00']:
-                    return
-                
-                with lock:
-                    results.append(style)
-                    success_count += 1
-                    
-                    # 如果设置了市值筛选阈值
-                    if filter_market_cap_threshold is not None:
-                        if market_cap_score and float(market_cap_score) < filter_market_cap_threshold:
-                            filtered_results.append(style)
-                            fund_name = style.get('基金名称', code)
-                            print(f'  ✓ [{success_count}/{total}] {fund_name}({code}) - 市值评分 {market_cap_score} < {filter_market_cap_threshold}，已筛选')
-                    else:
-                        if success_count % 50 == 0 or success_count == total:
-                            print(f'  [{success_count}/{total}] 已获取 {success_count} 只基金')
-        except Exception as e:
+            # 如果设置了市值筛选阈值
+            if filter_market_cap_threshold is not None:
+                if market_cap_score and float(market_cap_score) < filter_market_cap_threshold:
+                    filtered_results.append(style)
+                    fund_name = style.get('基金名称', code)
+                    print(f'  ✓ [{success_count}/{total}] {fund_name}({code}) - 市值评分 {market_cap_score} < {filter_market_cap_threshold}，已筛选')
+            else:
+                if success_count % 50 == 0 or success_count == total:
+                    print(f'  [{success_count}/{total}] 已获取 {success_count} 只基金')
+        except Exception:
             pass
     
-    # 使用线程池
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(fetch_fund, code) for code in fund_codes]
-        
-        for future in as_completed(futures):
-            future.result()  # 获取结果，确保异常被抛出
-    
     print(f'\n完成！共获取 {len(results)} 只基金数据（已过滤市值为0的）\n')
     
-    df_all = pd.DataFrame(results)
-    
-    # 调整列顺序，把基金名称放在第二列
-    if not df_all.empty and '基金名称' in df_all.columns:
-        cols = ['基金代码', '基金名称'] + [col for col in df_all.columns if col not in ['基金代码', '基金名称']]
-        df_all = df_all[cols]
+    df_all = order_style_columns(pd.DataFrame(results))
     
     if filter_market_cap_threshold is not None:
-        df_filtered = pd.DataFrame(filtered_results)
-        if not df_filtered.empty and '基金名称' in df_filtered.columns:
-            cols = ['基金代码', '基金名称'] + [col for col in df_filtered.columns if col not in ['基金代码', '基金名称']]
-            df_filtered = df_filtered[cols]
+        df_filtered = order_style_columns(pd.DataFrame(filtered_results))
         return df_all, df_filtered
     else:
         return df_all, None
 
+def list_scan_parts(output_dir):
+    """列出扫描目录下的分片文件"""
+    return sorted(glob.glob(os.path.join(output_dir, 'part-*.parquet')))
+
+def load_scanned_codes(output_dir):
+    """读取已扫描过的基金代码（包括没有风格数据的基金，不包括请求失败的基金）"""
+    scanned = set()
+    for path in list_scan_parts(output_dir):
+        scanned.update(pd.read_parquet(path, columns=['基金代码'])['基金代码'].astype(str))
+    return scanned
+
+def write_scan_part(output_dir, rows, part_index):
+    """把一批扫描结果写入新的分片文件（先写临时文件再改名，中断时不会留下损坏的分片）"""
+    path = os.path.join(output_dir, f'part-{part_index:05d}.parquet')
+    tmp_path = path + '.tmp'
+    pd.DataFrame(rows, dtype=object).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def scan_style_to_parquet(fund_codes, output_dir, fund_name_map=None, max_workers=20, chunk_size=SCAN_CHUNK_SIZE):
+    """流式扫描基金风格数据，每chunk_size只基金追加写入output_dir下的一个parquet分片
+    已扫描过的基金（包括没有数据的）会被跳过，扫描中断后重新运行即可从断点继续；
+    请求失败的基金不写入分片，下次运行时重新获取
+    所有取值按字符串保存，保证各分片的列类型一致
+    返回本次新扫描的基金数
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    scanned = load_scanned_codes(output_dir)
+    todo = [code for code in fund_codes if str(code) not in scanned]
+    print(f'扫描目录 {output_dir}: 已扫描 {len(scanned)} 只，剩余 {len(todo)} 只待扫描')
+    
+    part_index = len(list_scan_parts(output_dir))
+    buffer = []
+    scanned_count = 0
+    failed_count = 0
+    for code, style in iter_style(todo, max_workers=max_workers):
+        if isinstance(style, Exception):
+            failed_count += 1
+            continue
+        row = {'基金代码': str(code)}
+        if style:
+            row.update({key: None if value is None else str(value) for key, value in style.items()})
+            if fund_name_map and code in fund_name_map:
+                row['基金名称'] = str(fund_name_map[code])
+        buffer.append(row)
+        scanned_count += 1
+        if len(buffer) >= chunk_size:
+            write_scan_part(output_dir, buffer, part_index)
+            part_index += 1
+            buffer = []
+            print(f'  [{scanned_count}/{len(todo)}] 已扫描并写入 {part_index} 个分片')
+    if buffer:
+        write_scan_part(output_dir, buffer, part_index)
+    
+    print(f'\n扫描完成！本次新扫描 {scanned_count} 只基金，{failed_count} 只获取失败（下次运行时重试）\n')
+    return scanned_count
+
+def load_style_scan(output_dir):
+    """读取流式扫描结果，只返回有风格数据且市值评分不为0的基金
+    分片中按字符串保存的评分列（全部能转换时）还原为数值
+    """
+    parts = [pd.read_parquet(path) for path in list_scan_parts(output_dir)]
+    if not parts:
+        return pd.DataFrame()
+    df = pd.concat(parts, ignore_index=True).drop_duplicates('基金代码', keep='last')
+    style_columns = [col for col in df.columns if col not in ['基金代码', '基金名称']]
+    df = df[df[style_columns].notna().any(axis=1)]
+    if '市值_本基金' in df.columns:
+        df = df[~df['市值_本基金'].map(is_zero_market_cap)]
+    df = df.reset_index(drop=True)
+    for col in style_columns:
+        if col.endswith('_本基金') or col.endswith('_同类平均'):
+            numeric = pd.to_numeric(df[col], errors='coerce')
+            if numeric.notna().sum() == df[col].notna().sum():
+                df[col] = numeric
+    return order_style_columns(df)
+
+
+def scan_style(fund_codes, fund_name_map=None, max_workers=20, filter_market_cap_threshold=None, scan_dir=None):
+    """获取基金风格数据：安装了pyarrow时流式扫描到当天的扫描目录（中断后可续扫，多个调用方共用），
+    否则在内存中批量获取
+
+    Returns:
+        tuple: (全部结果, 市值评分低于阈值的结果（未设置阈值时为None）, 已成功扫描的基金代码集合)
+    """
+    codes = [str(code) for code in fund_codes]
+    if not PARQUET_AVAILABLE:
+        failed_codes = []
+        result_df, filtered_df = batch_get_style(codes, fund_name_map=fund_name_map, max_workers=max_workers,
+                                                 filter_market_cap_threshold=filter_market_cap_threshold,
+                                                 failed_codes=failed_codes)
+        return result_df, filtered_df, set(codes) - set(failed_codes)
+    
+    scan_dir = scan_dir or os.path.join(STYLE_SCAN_DIR, datetime.now().strftime('%Y%m%d'))
+    scan_style_to_parquet(codes, scan_dir, fund_name_map=fund_name_map, max_workers=max_workers)
+    result_df = load_style_scan(scan_dir)
+    if not result_df.empty:
+        result_df = result_df[result_df['基金代码'].isin(codes)].reset_index(drop=True)
+    print(f'共获取 {len(result_df)} 只基金数据（已过滤市值为0的）')
+    
+    filtered_df = None
+    if filter_market_cap_threshold is not None:
+        if not result_df.empty and '市值_本基金' in result_df.columns:
+            market_cap = pd.to_numeric(result_df['市值_本基金'], errors='coerce')
+            filtered_df = result_df[market_cap < filter_market_cap_threshold].reset_index(drop=True)
+        else:
+            filtered_df = pd.DataFrame()
+    return result_df, filtered_df, load_scanned_codes(scan_dir) & set(codes)
+
 def main():
     print('='*60)
     print('韭圈儿基金风格评分批量获取工具')
@@ -213,12 +454,12 @@ def main():
     print('  ✓ 并发线程: 20')
     print('\n正在获取基金列表...')
     
-    fund_list_df = get_fund_list(filter_types=['股票', '混合', '指数'])
+    fund_list_df = get_fund_list(filter_types=EQUITY_FUND_TYPES)
     
     # 提前过滤债券和定开基金
     print('\n提前过滤债券、定开、货币基金...')
     if 'name' in fund_list_df.columns:
-        mask = ~fund_list_df['name'].str.contains('债券|定开|货币|人民币|美元|300|500|定期|纯债|A50|持有|黄金|A', na=False)
+        mask = name_exclude_mask(fund_list_df)
         removed = fund_list_df[~mask]
         if len(removed) > 0:
             print(f'  - 排除含有"债券"或"定开"或"货币"的基金: {len(removed)} 只')
@@ -243,66 +484,16 @@ def main():
         print(f'已加载 {len(fund_name_map)} 只基金的名称')
     
     print(f'\n开始多线程获取 {len(fund_codes)} 只基金的风格评分...\n')
-    result_df, filtered_df = batch_get_style(fund_codes, fund_name_map=fund_name_map, max_workers=max_workers, filter_market_cap_threshold=filter_threshold)
+    # 安装了pyarrow时流式扫描：结果按分片追加写入当天的扫描目录，中断后重新运行会跳过已扫描的基金
+    result_df, filtered_df, _ = scan_style(fund_codes, fund_name_map=fund_name_map, max_workers=max_workers,
+                                           filter_market_cap_threshold=filter_threshold)
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    # 处理A/C类基金：如果同时有A类和C类，只保留C类
-    def filter_ac_funds(df):
-        if df.empty:
-            return df
-        
-        df = df.copy()
-        
-        # 创建基金基础名称（去掉A/C后缀）
-        def get_base_name(name):
-            if not isinstance(name, str):
-                return str(name)
-            # 去掉常见后缀
-            name = name.strip()
-            for suffix in ['A', 'C', 'B', 'E', 'D', 'F']:
-                if name.endswith(suffix):
-                    return name[:-1].rstrip(' ABCDEF')
-            # 检查中间是否有A/C（如"XX混合A类"）
-            import re
-            match = re.search(r'(.*?)(?:A|C|A类|C类)(?:$|\s|$)', name)
-            if match:
-                return match.group(1).rstrip()
-            return name
-        
-        df['基础名称'] = df['基金名称'].apply(get_base_name)
-        
-        # 按基础名称分组
-        base_groups = df.groupby('基础名称')
-        
-        keep_indices = []
-        
-        for base_name, group in base_groups:
-            # 检查是否有C类
-            c_mask = group['基金名称'].str.contains(r'C$|C类| C', na=False)
-            has_c = c_mask.any()
-            
-            if has_c:
-                # 只保留C类
-                c_indices = group[c_mask].index
-                keep_indices.extend(c_indices)
-                if len(group) > len(c_indices):
-                    a_names = group[~c_mask]['基金名称'].tolist()
-                    print(f'  - 同时有A/C类，保留C类，移除: {a_names}')
-            else:
-                # 没有C类，保留全部
-                keep_indices.extend(group.index)
-        
-        # 过滤并删除临时列
-        result_df = df.loc[keep_indices].copy()
-        result_df = result_df.drop('基础名称', axis=1)
-        
-        return result_df
-    
     # 处理A/C类并保存
     print('\n处理A/C类基金...')
     if filtered_df is not None and len(filtered_df) > 0:
-        filtered_df = filter_ac_funds(filtered_df)
+        filtered_df = prefer_c_share_class(filtered_df)
     
     # 保存全部数据
     filename_all = f'fund_style_all_{timestamp}.csv'
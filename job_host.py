@@ -0,0 +1,80 @@
+import time
+import schedule
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from enhanced_index import update_fund_data, INDEX_RANK_JOB
+from main import run_fund_data_update, FUND_DATA_JOB
+from run_cache import RunCache
+from trading_calendar import run_if_new_trading_data
+
+# 在同一进程中运行的任务：任务名称 -> 任务函数（函数接收共享的缓存）
+JOBS = {
+    FUND_DATA_JOB: run_fund_data_update,
+    INDEX_RANK_JOB: update_fund_data,
+}
+
+# 每天的执行时间
+JOB_TIME = "00:00"
+
+# 两个任务共享的缓存：基金列表、排名数据、基金详情、换手率等每晚只请求一次
+shared_cache = RunCache()
+
+_executor = ThreadPoolExecutor(max_workers=len(JOBS))
+_running = set()
+_running_lock = Lock()
+
+
+def run_job(name):
+    """执行单个任务，任务结束后从运行集合中移除"""
+    print(f"[{name}] 开始检查: {datetime.now()}")
+    try:
+        # 只有出现新的交易日数据时才执行，周末、节假日和重启时跳过
+        if run_if_new_trading_data(name, JOBS[name], cache=shared_cache):
+            print(f"[{name}] 执行完成: {datetime.now()}")
+    except Exception as e:
+        print(f"[{name}] 执行失败: {e}")
+    finally:
+        with _running_lock:
+            _running.discard(name)
+
+
+def submit_job(name):
+    """提交任务到线程池；上一次运行尚未结束时跳过本次，避免同一任务重叠执行"""
+    with _running_lock:
+        if name in _running:
+            print(f"[{name}] 上一次运行尚未结束，跳过本次")
+            return None
+        _running.add(name)
+    return _executor.submit(run_job, name)
+
+
+def run_all_jobs():
+    """并行提交所有任务；没有任务在运行时先清空共享缓存，保证每晚获取最新数据"""
+    with _running_lock:
+        if not _running:
+            shared_cache.clear()
+    return [future for future in (submit_job(name) for name in JOBS) if future is not None]
+
+
+def start_job_host():
+    """启动任务宿主：立即执行一次，之后每天定时执行"""
+    run_all_jobs()
+    schedule.every().day.at(JOB_TIME).do(run_all_jobs)
+    print(f"任务宿主已启动，每天 {JOB_TIME} 并行执行: {', '.join(JOBS)}")
+    print("按 Ctrl+C 可以停止程序。")
+
+    try:
+        while True:
+            try:
+                schedule.run_pending()
+            except Exception as e:
+                print(f"调度器运行时发生错误: {e}")
+            time.sleep(60)  # 每分钟检查一次
+    except KeyboardInterrupt:
+        print("程序已被用户中断")
+
+
+if __name__ == '__main__':
+    start_job_host()
@@ -2,102 +2,177 @@ from complete_fund_style_extraction import extract_fund_style_factors, find_simi
 import pandas as pd
 import akshare as ak
 import json
+import os
 import schedule
 import time
 from datetime import datetime
 
-from fund_data_processor import process_fund_data, process_fund_data_with_cache
-from jiuquan_fund import parse_fund_data
+from fund_data_processor import (compute_fund_data_batch, apply_fund_data_updates,
+                                 load_fund_data_store)
+from jiuquan_fund import parse_fund_data, parse_fund_data_batch
 from process_jiuquaner import process_jiuquaner_with_fund_names
 from simuwang_browser_stable import simuwang
+from stage_runner import Stage, run_stages
+from trading_calendar import run_if_new_trading_data
 
+# 宽基指数（及小微盘）基准基金
+INDEX_FUNDS = [
+    {"code": "510300", "name": "沪深300"},
+    {"code": "512510", "name": "中证500"},
+    {"code": "516300", "name": "中证1000"},
+    {"code": "563300", "name": "中证2000"},
+    {"code": "159907", "name": "国证2000"},
+    {"code": "320016", "name": "小微盘"}
+]
 
-def run_fund_data_update():
+# 定时任务名称（用于记录已处理的交易日）
+FUND_DATA_JOB = '自选基金数据更新'
+
+# 各阶段使用的线程池：浏览器阶段共用一个浏览器串行执行，HTTP阶段并发执行
+STAGE_POOLS = {'browser': 1, 'http': 4}
+
+
+def load_index_styles():
+    """获取几个宽基指数的风格因子数据"""
+    fund_codes = [fund["code"] for fund in INDEX_FUNDS]
+    fund_names = [fund["name"] for fund in INDEX_FUNDS]
+    return extract_fund_style_factors(fund_codes, fund_names, 'fund_style_factors.json')
+
+
+def load_watchlist(excel_path='jiuquaner.xlsx', fund_data_file_path='fund_data.json'):
+    """
+    读取自选基金代码和名称，同时读取fund_data.json的快照（在任何阶段写入该文件之前）
+    """
+    code_name_path = process_jiuquaner_with_fund_names(excel_path)
+    df = pd.read_excel(code_name_path, sheet_name=0, dtype={0: str})
+    fund_codes = df.iloc[:, 0].dropna().astype(str).str.strip().tolist()
+    fund_names = df.iloc[:, 1].dropna().astype(str).str.strip().tolist()
+    return fund_codes, fund_names, load_fund_data_store(fund_data_file_path)
+
+
+def fetch_turnover(fund_codes, cache=None):
+    """并发获取自选基金的换手率数据，返回 基金代码 -> 解析结果
+    cache: 可选，共享的RunCache，已由其他任务获取过的基金直接复用
+    """
+    if cache is None:
+        return parse_fund_data_batch(fund_codes, max_workers=10)
+    missing_codes = [fund_code for fund_code in fund_codes if not cache.contains('detail', fund_code)]
+    for fund_code, fund_info in parse_fund_data_batch(missing_codes, max_workers=10).items():
+        cache.seed('detail', fund_code, fund_info)
+    return {fund_code: cache.get('detail', fund_code, parse_fund_data, fund_code) for fund_code in fund_codes}
+
+
+def find_watchlist_similar_index(fund_data_file_path='fund_data.json'):
+    """查找自选基金最接近的指数，失败时返回None，不影响换手率和规模数据的合并写入"""
+    try:
+        return find_similar_index(fund_data_file_path, 'fund_style_factors.json')
+    except Exception as e:
+        print(f"查找最接近的指数失败: {str(e)}")
+        return None
+
+
+def merge_watchlist_updates(fund_codes, similar_index, turnover, scale_updates, fund_data_file_path='fund_data.json'):
+    """
+    把近似指数、换手率、规模和持有人结构数据合并到fund_data.json，只读写一次文件
+    （风格因子和私募排排网数据已由浏览器阶段写入）
+    """
+    with open(fund_data_file_path, 'r', encoding='utf-8') as f:
+        fund_data = json.load(f)
+    # 更新基金数据，添加近似指数信息
+    for fund_code, fund_info in (similar_index or {}).items():
+        if fund_code in fund_data:
+            fund_style_factors = fund_info.get("风格因子", {})
+            for factor_name, factor_data in fund_style_factors.items():
+                if "近似指数" in factor_data and fund_code in fund_data and "风格因子" in fund_data[fund_code]:
+                    if factor_name in fund_data[fund_code]["风格因子"]:
+                        # 添加近似指数信息到基金数据中
+                        fund_data[fund_code]["风格因子"][factor_name]["近似指数"] = factor_data["近似指数"]
+    # 写入换手率数据
+    for fund_code in fund_codes:
+        if fund_code not in fund_data:
+            continue
+        fund_info = turnover.get(fund_code) or {}
+        fund_data[fund_code]['换手率'] = fund_info.get('换手率')
+    # 添加基金规模信息和持有人结构信息
+    apply_fund_data_updates(fund_data, scale_updates)
+    # 写入更新后的数据到文件（先写临时文件再替换）
+    tmp_path = fund_data_file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(fund_data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, fund_data_file_path)
+    print("\n已将基金风格因子、指数对比结果、规模信息和持有人结构信息更新到fund_data.json文件中")
+
+
+def run_fund_data_update(cache=None):
     """
     运行基金数据更新任务
+    cache: 可选，共享的RunCache（如job_host中与enhanced_index的任务共享）
+    返回是否所有阶段都执行成功（定时任务只在成功时记录已处理的交易日）
+
+    各阶段按依赖关系并发执行：
+    1. index_styles      宽基指数风格因子（浏览器）
+    2. watchlist         自选基金代码和名称
+    3. watchlist_styles  自选基金风格因子，写入fund_data.json（浏览器，依赖2）
+    4. similar_index     最接近的指数（依赖1、3，失败时结果为None）
+    5. turnover          换手率（依赖2）
+    6. scale             规模和持有人结构，只对缓存过期的基金抓取（依赖2）
+    7. simuwang          私募排排网超额数据，逐只写入fund_data.json（浏览器，在3之后）
+    8. merge             合并4、5、6的结果，一次写入fund_data.json（在7结束之后，7失败也会执行）
+
+    fund_data.json 都是先写临时文件再替换，4读取时不会读到写了一半的文件
     """
     print(f"开始执行基金数据更新任务: {datetime.now()}")
-    
-    # 1.先获取几个宽基指数的数据
-    # 定义基金代码和名称列表
-    funds = [
-        {"code": "510300", "name": "沪深300"},
-        {"code": "512510", "name": "中证500"},
-        {"code": "516300", "name": "中证1000"},
-        {"code": "563300", "name": "中证2000"},
-        {"code": "159907", "name": "国证2000"},
-        {"code": "320016", "name": "小微盘"}
+    fund_data_file_path = 'fund_data.json'
 
+    stages = [
+        Stage('index_styles', load_index_styles, outputs=['index_styles'], pool='browser'),
+        Stage('watchlist', lambda: load_watchlist('jiuquaner.xlsx', fund_data_file_path),
+              outputs=['fund_codes', 'fund_names', 'store_snapshot']),
+        Stage('watchlist_styles',
+              lambda fund_codes, fund_names: extract_fund_style_factors(fund_codes, fund_names, fund_data_file_path),
+              inputs=['fund_codes', 'fund_names'], outputs=['watchlist_styles'], pool='browser'),
+        Stage('similar_index',
+              lambda index_styles, watchlist_styles: find_watchlist_similar_index(fund_data_file_path),
+              inputs=['index_styles', 'watchlist_styles'], outputs=['similar_index']),
+        Stage('turnover', lambda fund_codes: fetch_turnover(fund_codes, cache),
+              inputs=['fund_codes'], outputs=['turnover']),
+        # 只更新 fund_data.json 中已有的基金，不为其他基金创建空条目
+        Stage('scale',
+              lambda fund_codes, store_snapshot: compute_fund_data_batch(
+                  [c for c in fund_codes if c in store_snapshot], fund_data=store_snapshot),
+              inputs=['fund_codes', 'store_snapshot'], outputs=['scale_updates']),
+        # 爬取私募排排网超额数据
+        Stage('simuwang', lambda fund_codes: simuwang(fund_codes, fund_data_file_path),
+              inputs=['fund_codes'], after=['watchlist_styles'], pool='browser'),
+        Stage('merge',
+              lambda fund_codes, similar_index, turnover, scale_updates: merge_watchlist_updates(
+                  fund_codes, similar_index, turnover, scale_updates, fund_data_file_path),
+              inputs=['fund_codes', 'similar_index', 'turnover', 'scale_updates'], after=['simuwang']),
     ]
-    fund_codes = [fund["code"] for fund in funds]
-    fund_names = [fund["name"] for fund in funds]
-    # 调用方法获取最新的基金数据
-    data = extract_fund_style_factors(fund_codes, fund_names,'fund_style_factors.json')
-
-    #2.获取基金名称
-    excel_path = 'jiuquaner.xlsx'
-    code_name_path = process_jiuquaner_with_fund_names(excel_path)
-    #3.获取自选的基金数据
-    # 读取Excel文件
     try:
-        df = pd.read_excel(code_name_path, sheet_name=0, dtype={0: str})
-        fund_codes = df.iloc[:, 0].dropna().astype(str).str.strip().tolist()
-        fund_names = df.iloc[:, 1].dropna().astype(str).str.strip().tolist()
-        fund_data_file_path = 'fund_data.json'
-        # 提取风格因子数据并写入到json中
-        data = extract_fund_style_factors(fund_codes, fund_names,fund_data_file_path)
-        # 查找最接近的指数
-        similar_index_data = find_similar_index(fund_data_file_path, 'fund_style_factors.json')
-        # 将结果保存到fund_data.json文件中
-        with open(fund_data_file_path, 'r', encoding='utf-8') as f:
-            fund_data = json.load(f)
-        # 更新基金数据，添加近似指数信息
-        for fund_code, fund_info in similar_index_data.items():
-            if fund_code in fund_data:
-                fund_style_factors = fund_info.get("风格因子", {})
-                for factor_name, factor_data in fund_style_factors.items():
-                    if "近似指数" in factor_data and fund_code in fund_data and "风格因子" in fund_data[fund_code]:
-                        if factor_name in fund_data[fund_code]["风格因子"]:
-                            # 添加近似指数信息到基金数据中
-                            fund_data[fund_code]["风格因子"][factor_name]["近似指数"] = factor_data["近似指数"]
-        # 写入换手率数据
-        for fund_code in fund_codes:
-            fund_info = parse_fund_data(fund_code)
-            if '换手率' in fund_info:
-                fund_data[fund_code]['换手率'] = fund_info['换手率']
-            else:
-                fund_data[fund_code]['换手率'] = None
-        # 写入更新后的数据到文件
-        with open(fund_data_file_path, 'w', encoding='utf-8') as f:
-            json.dump(fund_data, f, ensure_ascii=False, indent=2)
-        
-        # 添加基金规模信息
-        print("\n正在获取基金规模信息...")
-        for fund_code in fund_codes:
-            print(f"{fund_code} at {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            if fund_code in fund_data:
-                print(f"正在获取基金 {fund_code} 的规模信息...")
-                # 聚合规模信息和持有人结构信息并写入到json（带缓存机制）
-                process_fund_data_with_cache(fund_code)
-        
-        print("\n已将基金风格因子、指数对比结果、规模信息和持有人结构信息更新到fund_data.json文件中")
-        # 爬取私募排排网超额数据
-        simuwang(fund_codes, fund_data_file_path)
-        
+        failed = set()
+        context = run_stages(stages, STAGE_POOLS, failed=failed)
+        if context.get('similar_index') is None:
+            failed.add('similar_index')
+        if failed:
+            print(f"基金数据更新任务未完全成功，失败的阶段: {', '.join(sorted(failed))}")
+            return False
         print(f"基金数据更新任务完成: {datetime.now()}")
+        return True
     except Exception as e:
-        print(f"读取Excel文件失败: {str(e)}")
+        print(f"基金数据更新任务失败: {str(e)}")
+        return False
 
 
 def run_scheduler():
     """
     运行定时任务调度器
     """
-    # 每天凌晨12点执行一次
-    schedule.every().day.at("00:00").do(run_fund_data_update)
+    # 每天凌晨12点检查一次，只有出现新的交易日数据时才执行（周末、节假日跳过）
+    schedule.every().day.at("00:00").do(run_if_new_trading_data, FUND_DATA_JOB, run_fund_data_update)
     
-    # 程序启动时立即执行一次
-    run_fund_data_update()
+    # 程序启动时立即检查一次，上一个交易日的数据已处理过则不重复执行
+    run_if_new_trading_data(FUND_DATA_JOB, run_fund_data_update)
     
     # 持续运行调度器
     while True:
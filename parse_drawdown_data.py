@@ -6,6 +6,19 @@ from selenium.webdriver.support import expected_conditions as EC
 import json
 import time
 
+# 回撤数据所在表格的选择器
+DRAWDOWN_TABLE_SELECTOR = "div.el-table--fit.el-table--enable-row-hover.el-table--enable-row-transition.el-table.el-table--layout-fixed.mt-16.header-blue.is-scrolling-none"
+
+# 回撤行各列对应的时间段（第一列为行标题"回撤"）
+DRAWDOWN_PERIODS = ["本基金", "成立以来", "最近一月", "最近三月", "最近半年", "今年以来", "最近一年", "最近两年", "最近三年"]
+
+
+def build_drawdown_data(cell_texts):
+    """
+    将回撤行的单元格文本映射为 {时间段: 回撤} 字典（跳过第一列行标题）
+    """
+    return {DRAWDOWN_PERIODS[i]: cell_texts[i] for i in range(1, min(len(cell_texts), len(DRAWDOWN_PERIODS)))}
+
 def retry_on_network_error(max_retries=3, delay=5):
     """
     装饰器：在网络连接错误时重试
@@ -43,7 +56,7 @@ def parse_drawdown_data(html_content=None, driver=None):
         if driver:
             # 定位包含回撤数据的表格
             table = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div.el-table--fit.el-table--enable-row-hover.el-table--enable-row-transition.el-table.el-table--layout-fixed.mt-16.header-blue.is-scrolling-none"))
+                EC.presence_of_element_located((By.CSS_SELECTOR, DRAWDOWN_TABLE_SELECTOR))
             )
             
             # 查找表格主体
@@ -67,16 +80,13 @@ def parse_drawdown_data(html_content=None, driver=None):
             # 获取所有单元格
             cells = drawdown_row.find_elements(By.CSS_SELECTOR, "td")
             
-            # 提取各时间段的回撤数据
-            periods = ["本基金", "成立以来", "最近一月", "最近三月", "最近半年", "今年以来", "最近一年", "最近两年", "最近三年"]
-            
             # 遍历单元格，提取数据（跳过第一列，因为那是行标题"回撤"）
-            for i in range(1, min(len(cells), len(periods))):
+            for i in range(1, min(len(cells), len(DRAWDOWN_PERIODS))):
                 cell = cells[i]
                 cell_div = cell.find_element(By.CSS_SELECTOR, "div.cell")
                 span_element = cell_div.find_element(By.CSS_SELECTOR, "span")
                 value = span_element.text
-                drawdown_data[periods[i]] = value
+                drawdown_data[DRAWDOWN_PERIODS[i]] = value
                 
         # 根据您提供的HTML示例数据
         else:
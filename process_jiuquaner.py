@@ -3,6 +3,20 @@ import akshare as ak
 import os
 from datetime import datetime
 
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# 基金列表缓存文件：安装了pyarrow时使用parquet，读取比Excel快得多
+FUND_LIST_FILE = 'fund_list.parquet' if PARQUET_AVAILABLE else 'fund_list.xlsx'
+
+
+def normalize_fund_codes(codes):
+    """把基金代码（数字或字符串）统一格式化为6位字符串，无法解析的为缺失值"""
+    return pd.to_numeric(codes, errors='coerce').astype('Int64').astype('string').str.zfill(6)
+
 
 def get_fund_list(force_update=False):
     """
@@ -14,7 +28,7 @@ def get_fund_list(force_update=False):
     Returns:
         pandas.DataFrame: 基金列表数据
     """
-    fund_list_file = 'fund_list.xlsx'
+    fund_list_file = FUND_LIST_FILE
     
     # 检查文件是否存在且不是本月创建的
     if os.path.exists(fund_list_file) and not force_update:
@@ -26,8 +40,11 @@ def get_fund_list(force_update=False):
         # 如果是本月创建的文件，则直接读取
         if file_date.year == current_date.year and file_date.month == current_date.month:
             print("读取现有的基金列表文件")
-            fund_list_df = pd.read_excel(fund_list_file)
-            print(f"fund_list.xlsx 中共有 {len(fund_list_df)} 条记录")
+            if PARQUET_AVAILABLE:
+                fund_list_df = pd.read_parquet(fund_list_file)
+            else:
+                fund_list_df = pd.read_excel(fund_list_file, dtype={'基金代码': str})
+            print(f"{fund_list_file} 中共有 {len(fund_list_df)} 条记录")
             return fund_list_df
         else:
             print("现有基金列表文件不是本月创建，需要更新")
@@ -37,10 +54,13 @@ def get_fund_list(force_update=False):
     fund_list = ak.fund_name_em()
     
     # 将基金代码格式化为6位数，不足的前面补0
-    fund_list['基金代码'] = fund_list['基金代码'].apply(lambda x: str(x).zfill(6))
+    fund_list['基金代码'] = fund_list['基金代码'].astype(str).str.zfill(6)
     
-    # 将基金列表保存到Excel文件
-    fund_list.to_excel(fund_list_file, index=False)
+    # 将基金列表保存到缓存文件
+    if PARQUET_AVAILABLE:
+        fund_list.to_parquet(fund_list_file, index=False)
+    else:
+        fund_list.to_excel(fund_list_file, index=False)
     print(f"已将{len(fund_list)}只基金数据保存到{fund_list_file}文件中")
     
     return fund_list
@@ -57,24 +77,18 @@ def process_jiuquaner_with_fund_names(excel_path):
     # 获取基金列表数据
     fund_list_df = get_fund_list()
     
-    # 创建一个字典用于快速查找基金简称
-    # 注意基金代码在CSV中是数字格式，而在Excel中也是数字格式
-    fund_code_to_name = {}
-    for _, row in fund_list_df.iterrows():
-        fund_code = int(row['基金代码'])  # 转换为整数格式
-        fund_name = row['基金简称']
-        fund_code_to_name[fund_code] = fund_name
+    # 两边的基金代码统一为6位字符串（Excel中的代码是数字格式）后一次性映射基金简称
+    fund_code_to_name = pd.Series(
+        fund_list_df['基金简称'].to_numpy(),
+        index=normalize_fund_codes(fund_list_df['基金代码'])
+    )
+    fund_code_to_name = fund_code_to_name[~fund_code_to_name.index.duplicated()]
     
-    # 为jiuquaner数据添加基金简称列
-    def get_fund_name(code):
-        # 直接使用整数格式进行匹配
-        return fund_code_to_name.get(int(code), "未找到")
+    # 将code列格式化为6位数，不足的前面补0
+    jiuquaner_df['code'] = normalize_fund_codes(jiuquaner_df['code'])
     
     # 添加name列
-    jiuquaner_df['name'] = jiuquaner_df['code'].apply(get_fund_name)
-    
-    # 将code列格式化为6位数，不足的前面补0
-    jiuquaner_df['code'] = jiuquaner_df['code'].apply(lambda x: str(int(x)).zfill(6))
+    jiuquaner_df['name'] = jiuquaner_df['code'].map(fund_code_to_name).fillna("未找到")
     
     # 保存到新文件
     output_filename = 'jiuquaner_with_names.xlsx'
@@ -0,0 +1,157 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+import akshare as ak
+
+from trading_calendar import last_trading_day, to_date
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# 开放式基金排名数据仓库目录，按交易日分区：rank_warehouse/trade_date=YYYYMMDD/part.parquet
+RANK_WAREHOUSE_DIR = 'rank_warehouse'
+
+# 按字典编码（category）存储的文本列
+RANK_CATEGORY_COLUMNS = ['基金简称', '基金类型', '手续费']
+
+# 存储为数值的列
+RANK_NUMERIC_COLUMNS = ['单位净值', '累计净值', '日增长率', '近1周', '近1月', '近3月', '近6月',
+                        '近1年', '近2年', '近3年', '今年来', '成立来', '自定义']
+
+
+def partition_path(trade_date):
+    """交易日对应的分区文件路径"""
+    return os.path.join(RANK_WAREHOUSE_DIR, f"trade_date={to_date(trade_date).strftime('%Y%m%d')}", 'part.parquet')
+
+
+def snapshot_trade_date(rank_df):
+    """排名数据对应的交易日：取日期列的最大值，没有日期列时取上一个交易日"""
+    if '日期' in rank_df.columns:
+        dates = pd.to_datetime(rank_df['日期'], errors='coerce').dropna()
+        if not dates.empty:
+            return dates.max().date()
+    return last_trading_day()
+
+
+def fund_type_map():
+    """基金代码 -> 基金类型（来自天天基金基金列表），获取失败时返回空映射"""
+    try:
+        from jiuquaner_fund_style import load_fund_universe
+        universe = load_fund_universe()
+        return pd.Series(universe['type'].astype(str).to_numpy(), index=universe['code'].astype(str))
+    except Exception as e:
+        print(f"获取基金类型失败: {e}")
+        return pd.Series(dtype=object)
+
+
+def save_rank_snapshot(rank_df, trade_date=None):
+    """
+    把一天的排名数据写入仓库分区：基金代码补齐6位，收益率列转为数值，
+    基金简称、基金类型等文本列按字典编码存储，行顺序与akshare返回的一致；同一交易日重复写入时覆盖
+    返回写入的文件路径，未安装pyarrow时返回None
+    """
+    if not PARQUET_AVAILABLE or rank_df is None or rank_df.empty:
+        return None
+    trade_date = to_date(trade_date) if trade_date is not None else snapshot_trade_date(rank_df)
+
+    df = rank_df.copy()
+    df['基金代码'] = df['基金代码'].astype(str).str.zfill(6)
+    for col in RANK_NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    if '基金类型' not in df.columns:
+        df['基金类型'] = df['基金代码'].map(fund_type_map())
+    for col in RANK_CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    df = df.reset_index(drop=True)
+
+    path = partition_path(trade_date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 临时文件以"."开头，按目录读取仓库时会被忽略（写入中断留下的临时文件不会被读到）
+    tmp_path = os.path.join(os.path.dirname(path), '.part.parquet.tmp')
+    df.to_parquet(tmp_path, index=False, compression='zstd')
+    os.replace(tmp_path, path)
+    print(f"排名数据已写入仓库: {path}（{len(df)} 只基金）")
+    return path
+
+
+def load_rank_snapshot(trade_date):
+    """
+    读取某个交易日的排名数据，并还原为akshare返回的格式（文本列为普通字符串，不含基金类型列）
+    该交易日没有数据时返回None
+    """
+    path = partition_path(trade_date)
+    if not PARQUET_AVAILABLE or not os.path.exists(path):
+        return None
+    df = pd.read_parquet(path)
+    for col in RANK_CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(object)
+    return df.drop(columns=['基金类型'], errors='ignore')
+
+
+def latest_snapshot_date():
+    """仓库中最新的交易日，没有数据时返回None"""
+    if not os.path.isdir(RANK_WAREHOUSE_DIR):
+        return None
+    dates = [name[len('trade_date='):] for name in os.listdir(RANK_WAREHOUSE_DIR)
+             if name.startswith('trade_date=') and os.path.exists(os.path.join(RANK_WAREHOUSE_DIR, name, 'part.parquet'))]
+    if not dates:
+        return None
+    return datetime.strptime(max(dates), '%Y%m%d').date()
+
+
+def fetch_rank_table():
+    """
+    获取全部开放式基金排名数据：每次都从akshare获取最新数据并写入仓库
+    （收盘后akshare已有当天的数据），获取失败时读取仓库中最新的数据
+    """
+    try:
+        rank_df = ak.fund_open_fund_rank_em(symbol="全部")
+    except Exception as e:
+        trade_date = latest_snapshot_date()
+        rank_df = load_rank_snapshot(trade_date) if trade_date is not None else None
+        if rank_df is None:
+            raise
+        print(f"获取排名数据失败（{e}），使用排名数据仓库中 {trade_date} 的数据: {len(rank_df)} 只基金")
+        return rank_df
+    try:
+        save_rank_snapshot(rank_df)
+    except Exception as e:
+        print(f"写入排名数据仓库失败: {e}")
+    return rank_df
+
+
+def query_rank_history(fund_codes=None, start_date=None, end_date=None, columns=None):
+    """
+    查询一段时间内指定基金的排名数据，交易日和基金代码条件下推到parquet读取
+
+    Args:
+        fund_codes (list, optional): 基金代码列表，不提供时返回全部基金
+        start_date, end_date (optional): 起止交易日（含），支持date或'YYYY-MM-DD'
+        columns (list, optional): 只读取的列（基金代码和trade_date总会返回）
+
+    Returns:
+        DataFrame: 每行一只基金一个交易日，trade_date为YYYYMMDD整数
+    """
+    if not PARQUET_AVAILABLE or not os.path.isdir(RANK_WAREHOUSE_DIR):
+        return pd.DataFrame()
+    filters = []
+    if start_date is not None:
+        filters.append(('trade_date', '>=', int(to_date(start_date).strftime('%Y%m%d'))))
+    if end_date is not None:
+        filters.append(('trade_date', '<=', int(to_date(end_date).strftime('%Y%m%d'))))
+    if fund_codes is not None:
+        filters.append(('基金代码', 'in', [str(code).zfill(6) for code in fund_codes]))
+    if columns is not None:
+        columns = list(dict.fromkeys(['trade_date', '基金代码'] + list(columns)))
+    df = pd.read_parquet(RANK_WAREHOUSE_DIR, engine='pyarrow', filters=filters or None, columns=columns)
+    # 分区列读回时是categorical类型，转换回整数
+    if 'trade_date' in df.columns:
+        df['trade_date'] = df['trade_date'].astype(int)
+    return df
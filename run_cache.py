@@ -0,0 +1,65 @@
+from concurrent.futures import Future
+from threading import Lock
+
+
+class RunCache:
+    """单次运行内的基金数据缓存
+
+    按 (数据类型, 基金代码) 缓存抓取结果，多个线程同时请求同一只基金时
+    只有第一个线程真正发起请求，其余线程等待同一个结果（single-flight）。
+    抓取失败的结果不缓存，后续请求会重新抓取。
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = Lock()
+
+    def get(self, kind, key, func, *args, **kwargs):
+        """获取缓存结果，未缓存时调用 func(*args, **kwargs) 抓取并缓存"""
+        cache_key = (kind, str(key))
+        with self._lock:
+            future = self._futures.get(cache_key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[cache_key] = future
+        if owner:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                with self._lock:
+                    self._futures.pop(cache_key, None)
+                future.set_exception(e)
+        return future.result()
+
+    def seed(self, kind, key, value):
+        """写入已在别处获取到的结果（如批量接口的返回值）"""
+        future = Future()
+        future.set_result(value)
+        with self._lock:
+            self._futures[(kind, str(key))] = future
+
+    def contains(self, kind, key):
+        """是否已缓存（或正在抓取）"""
+        with self._lock:
+            return (kind, str(key)) in self._futures
+
+    def peek(self, kind, key, default=None):
+        """读取已完成的缓存结果，未缓存或尚未完成时返回default"""
+        with self._lock:
+            future = self._futures.get((kind, str(key)))
+        if future is None or not future.done() or future.exception() is not None:
+            return default
+        return future.result()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._futures.clear()
+
+
+def cached_call(cache, kind, key, func, *args, **kwargs):
+    """cache为None时直接调用func，否则经由缓存调用"""
+    if cache is None:
+        return func(*args, **kwargs)
+    return cache.get(kind, key, func, *args, **kwargs)
@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import random
 import urllib.error
 
@@ -17,7 +19,76 @@ import sys
 import json
 import undetected_chromedriver as uc
 
-from parse_drawdown_data import parse_drawdown_data
+from parse_drawdown_data import parse_drawdown_data, build_drawdown_data, DRAWDOWN_TABLE_SELECTOR
+
+# 会话文件加密依赖 cryptography，未安装时不持久化登录状态，每次照常登录
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    SESSION_ENCRYPTION_AVAILABLE = True
+except ImportError:
+    SESSION_ENCRYPTION_AVAILABLE = False
+
+SIMUWANG_HOME_URL = "https://www.simuwang.com/gmjj"
+# 登录弹窗选择器，用于判断当前是否处于未登录状态
+LOGIN_POPUP_SELECTOR = "div[data-v-ba0c5dd9].w-fit"
+# 已登录时页面顶部显示的用户头像/昵称
+LOGGED_IN_SELECTOR = ".user-avatar, .user-info .nickname, img.avatar"
+
+# 一次性读取回撤表格（arguments[0]）第二行与阶段收益表格全部行的脚本，
+# 返回 {drawdown: [单元格文本...], stage: [[区间, 基金收益, 业绩比较基准, 超额收益(几何), 同类平均], ...]}
+EXTRACT_TABLES_JS = """
+var text = function (el) { return el ? el.innerText.trim() : ''; };
+var result = {drawdown: [], stage: null};
+var drawdownRows = arguments[0].querySelectorAll('table.el-table__body tbody tr');
+if (drawdownRows.length > 1) {
+    drawdownRows[1].querySelectorAll('td').forEach(function (td) {
+        result.drawdown.push(text(td.querySelector('div.cell span')));
+    });
+}
+var aside = document.querySelector('aside[data-v-246b1dcb]');
+aside = aside ? aside.nextElementSibling : null;
+while (aside && aside.tagName !== 'ASIDE') { aside = aside.nextElementSibling; }
+var stageTable = aside ? aside.querySelector('div.el-table--fit table.el-table__body') : null;
+if (stageTable) {
+    result.stage = [];
+    stageTable.querySelectorAll('tbody tr').forEach(function (tr) {
+        var cells = tr.querySelectorAll('td');
+        if (cells.length >= 5) {
+            result.stage.push([
+                text(cells[0].querySelector('.cell')),
+                text(cells[1].querySelector('div')),
+                text(cells[2].querySelector('div')),
+                text(cells[3].querySelector('div')),
+                text(cells[4].querySelector('div'))
+            ]);
+        }
+    });
+}
+return result;
+"""
+
+
+def build_stage_return_row(cells):
+    """
+    将阶段收益表格一行的单元格文本映射为区间收益数据结构
+    :param cells: [区间, 基金收益, 业绩比较基准, 超额收益(几何), 同类平均]
+    """
+    interval, fund_return, benchmark, excess_return, average = cells[:5]
+    return {
+        "区间": interval,
+        "基金收益": {
+            "百分比": fund_return,
+        },
+        "业绩比较基准": {
+            "百分比": benchmark,
+        },
+        "超额收益(几何)": {
+            "百分比": excess_return,
+        },
+        "同类平均": {
+            "百分比": average,
+        }
+    }
 
 
 def retry_on_network_error(max_retries=3, delay=5):
@@ -53,6 +124,11 @@ class SimuwangBrowser:
     def __init__(self):
         self.driver = None
         self.config = self.load_config()
+        # 加密保存的登录会话（cookies + localStorage）
+        self.session_file = self.config.get("session_file", "simuwang_session.bin")
+        # 基金代码 -> 基金详情页URL 的缓存，命中后直接打开详情页，无需搜索
+        self.url_cache_file = self.config.get("url_cache_file", "simuwang_fund_urls.json")
+        self.fund_urls = self.load_fund_urls()
 
     def load_config(self):
         """
@@ -68,6 +144,44 @@ class SimuwangBrowser:
             print(f"读取配置文件时出现错误: {str(e)}")
             return {}
 
+    def load_fund_urls(self):
+        """
+        加载基金详情页URL缓存
+        """
+        if os.path.exists(self.url_cache_file):
+            try:
+                with open(self.url_cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"读取基金详情页URL缓存时出现错误: {str(e)}")
+        return {}
+
+    def save_fund_urls(self):
+        """
+        保存基金详情页URL缓存
+        """
+        try:
+            with open(self.url_cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self.fund_urls, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存基金详情页URL缓存时出现错误: {str(e)}")
+
+    def remember_fund_url(self, fund_code):
+        """
+        记录当前页面为该基金的详情页URL
+        """
+        url = self.driver.current_url
+        if url and url.rstrip('/') != SIMUWANG_HOME_URL and 'simuwang.com' in url:
+            self.fund_urls[fund_code] = url
+            self.save_fund_urls()
+
+    def forget_fund_url(self, fund_code):
+        """
+        详情页URL失效时从缓存中移除
+        """
+        if self.fund_urls.pop(fund_code, None):
+            self.save_fund_urls()
+
     @retry_on_network_error(max_retries=3, delay=5)
     def open_simuwang(self):
         """
@@ -92,7 +206,7 @@ class SimuwangBrowser:
 
             # 直接打开公募基金页面
             print("正在打开私募排排网公募基金页面...")
-            self.driver.get("https://www.simuwang.com/gmjj")
+            self.driver.get(SIMUWANG_HOME_URL)
 
             # 等待页面加载完成
             time.sleep(3)
@@ -114,7 +228,7 @@ class SimuwangBrowser:
         try:
             # 使用指定的选择器定位登录弹窗
             login_popup = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-v-ba0c5dd9].w-fit"))
+                EC.presence_of_element_located((By.CSS_SELECTOR, LOGIN_POPUP_SELECTOR))
             )
             print("找到登录弹窗")
             time.sleep(random.uniform(1, 3))
@@ -178,6 +292,118 @@ class SimuwangBrowser:
             print(f"登录过程中出现错误: {str(e)}")
             return False
 
+    def _get_session_cipher(self, salt):
+        """
+        根据配置中的账号密码派生会话文件的加密密钥
+        """
+        secret = self.config.get("session_secret") or f'{self.config.get("phone", "")}:{self.config.get("password", "")}'
+        key = hashlib.pbkdf2_hmac('sha256', secret.encode('utf-8'), salt, 200000)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def save_session(self):
+        """
+        将当前登录状态（cookies 和 localStorage）加密保存到本地
+        """
+        if not SESSION_ENCRYPTION_AVAILABLE:
+            print("未安装 cryptography，跳过保存登录会话")
+            return False
+        try:
+            session_data = {
+                "cookies": self.driver.get_cookies(),
+                "local_storage": self.driver.execute_script(
+                    "var items = {};"
+                    "for (var i = 0; i < localStorage.length; i++) {"
+                    "  var key = localStorage.key(i); items[key] = localStorage.getItem(key);"
+                    "}"
+                    "return items;"
+                ),
+                "saved_at": time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+            salt = os.urandom(16)
+            token = self._get_session_cipher(salt).encrypt(
+                json.dumps(session_data, ensure_ascii=False).encode('utf-8'))
+            with open(self.session_file, 'wb') as f:
+                f.write(salt + token)
+            print(f"登录会话已加密保存到 {self.session_file}")
+            return True
+        except Exception as e:
+            print(f"保存登录会话时出现错误: {str(e)}")
+            return False
+
+    def restore_session(self):
+        """
+        从本地加密文件恢复登录状态，需在已打开私募排排网页面后调用
+        """
+        if not SESSION_ENCRYPTION_AVAILABLE or not os.path.exists(self.session_file):
+            return False
+        try:
+            with open(self.session_file, 'rb') as f:
+                raw = f.read()
+            salt, token = raw[:16], raw[16:]
+            session_data = json.loads(self._get_session_cipher(salt).decrypt(token).decode('utf-8'))
+        except InvalidToken:
+            print("登录会话文件无法解密（账号或密钥已变更），将重新登录")
+            return False
+        except Exception as e:
+            print(f"读取登录会话时出现错误: {str(e)}")
+            return False
+
+        try:
+            for cookie in session_data.get("cookies", []):
+                # expiry 为浮点数时 add_cookie 会报错
+                if "expiry" in cookie:
+                    cookie["expiry"] = int(cookie["expiry"])
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception:
+                    pass
+            for key, value in session_data.get("local_storage", {}).items():
+                self.driver.execute_script("localStorage.setItem(arguments[0], arguments[1]);", key, value)
+            # 刷新页面使会话生效
+            self.driver.get(SIMUWANG_HOME_URL)
+            print(f"已恢复 {session_data.get('saved_at', '')} 保存的登录会话")
+            return True
+        except Exception as e:
+            print(f"恢复登录会话时出现错误: {str(e)}")
+            return False
+
+    def is_logged_in(self, timeout=10):
+        """
+        判断当前会话是否有效：等待页面加载完成后，出现用户头像/昵称视为已登录，
+        出现登录弹窗或超时未出现登录标识均视为未登录
+        """
+        self.wait_page_ready()
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                lambda driver: driver.find_elements(By.CSS_SELECTOR, LOGGED_IN_SELECTOR)
+                or driver.find_elements(By.CSS_SELECTOR, LOGIN_POPUP_SELECTOR)
+            )
+        except Exception:
+            return False
+        return bool(self.driver.find_elements(By.CSS_SELECTOR, LOGGED_IN_SELECTOR))
+
+    def ensure_login(self):
+        """
+        优先复用本地保存的登录会话，会话失效时才执行完整的登录流程
+        """
+        if self.restore_session():
+            if self.is_logged_in():
+                print("登录会话有效，跳过登录")
+                return True
+            print("登录会话已过期，重新登录")
+            # 清除失效的 cookies 和 localStorage，避免干扰登录流程
+            self.driver.delete_all_cookies()
+            self.driver.execute_script("localStorage.clear();")
+            self.driver.get(SIMUWANG_HOME_URL)
+            self.wait_page_ready()
+
+        if not self.login():
+            return False
+        # 等待登录完成后再保存会话
+        time.sleep(3)
+        self.save_session()
+        return True
+
     def search_fund(self, fund_code):
         """
         搜索基金
@@ -185,7 +411,7 @@ class SimuwangBrowser:
         try:
             # 每次搜索前都回到基金首页
             print("正在返回基金首页...")
-            self.driver.get("https://www.simuwang.com/gmjj")
+            self.driver.get(SIMUWANG_HOME_URL)
             time.sleep(3)
 
             # 等待搜索框出现
@@ -287,13 +513,8 @@ class SimuwangBrowser:
             # self.driver.close()
             self.driver.switch_to.window(all_windows[-1])
             # 等待页面加载完成，最多等待30秒
-            try:
-                WebDriverWait(self.driver, 30).until(
-                    lambda driver: driver.execute_script("return document.readyState") == "complete"
-                )
+            if self.wait_page_ready():
                 print("页面加载完成")
-            except Exception as e:
-                print(f"页面加载超时，但将继续执行: {str(e)}")
 
             print(f"已切换到新页面，当前URL: {self.driver.current_url}")
             return True
@@ -301,11 +522,115 @@ class SimuwangBrowser:
             print(f"搜索基金时出现错误: {str(e)}")
             return False
 
-    def extract_data(self, fund_code, fund_data_file_path="fund_data.json"):
+    def wait_page_ready(self, timeout=30):
+        """
+        等待当前标签页加载完成
+        """
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                lambda driver: driver.execute_script("return document.readyState") == "complete"
+            )
+            return True
+        except Exception as e:
+            print(f"页面加载超时，但将继续执行: {str(e)}")
+            return False
+
+    def extract_in_tabs(self, fund_codes, fund_data_file_path="fund_data.json", max_tabs=4):
+        """
+        在同一个已登录浏览器中按批打开多个标签页，直接访问已缓存的详情页URL并提取数据
+
+        同一个WebDriver会话的命令是串行执行的，因此这里让各标签页的页面加载并行进行，
+        数据提取仍逐个标签页完成。
+        :return: 提取失败、需要走搜索流程的基金代码列表
+        """
+        failed_codes = []
+        base_window = self.driver.current_window_handle
+        for start in range(0, len(fund_codes), max_tabs):
+            batch = fund_codes[start:start + max_tabs]
+            tabs = []
+            # 先一次性打开本批所有标签页，页面在后台同时加载
+            for fund_code in batch:
+                existing_handles = set(self.driver.window_handles)
+                self.driver.execute_script("window.open(arguments[0], '_blank');", self.fund_urls[fund_code])
+                new_handles = [h for h in self.driver.window_handles if h not in existing_handles]
+                if new_handles:
+                    tabs.append((fund_code, new_handles[0]))
+                else:
+                    failed_codes.append(fund_code)
+            # 依次切换到各标签页提取数据
+            for fund_code, handle in tabs:
+                print(f"\n开始查询基金: {fund_code}（直接访问详情页）")
+                try:
+                    self.driver.switch_to.window(handle)
+                    self.wait_page_ready()
+                    if not self.extract_data(fund_code, fund_data_file_path):
+                        self.forget_fund_url(fund_code)
+                        failed_codes.append(fund_code)
+                except Exception as e:
+                    print(f"标签页中查询基金 {fund_code} 失败: {str(e)}")
+                    self.forget_fund_url(fund_code)
+                    failed_codes.append(fund_code)
+                finally:
+                    try:
+                        self.driver.close()
+                    except Exception:
+                        pass
+            self.driver.switch_to.window(base_window)
+        return failed_codes
+
+    def _extract_tables_by_js(self, drawdown_table):
+        """
+        通过一次 execute_script 调用同时读取回撤表格和阶段收益表格
+        :param drawdown_table: 回撤表格元素
+        :return: (回撤数据, 阶段收益行列表)，读取失败时对应位置为None
+        """
+        try:
+            tables = self.driver.execute_script(EXTRACT_TABLES_JS, drawdown_table)
+        except Exception as e:
+            print(f"批量读取表格数据失败，改用逐个单元格读取: {str(e)}")
+            return None, None
+        drawdown_data = build_drawdown_data(tables.get("drawdown") or []) or None
+        stage_rows = tables.get("stage")
+        data_list = [build_stage_return_row(cells) for cells in stage_rows] if stage_rows else None
+        return drawdown_data, data_list
+
+    def _extract_stage_rows(self, outer_container):
+        """
+        逐个单元格读取阶段收益表格（每个单元格一次WebDriver调用）
+        """
+        # 在外部容器同级查找下一个aside容器
+        inner_aside_container = outer_container.find_element(By.XPATH,
+                                                             "./following-sibling::aside")
+        # 在内部aside容器中查找div.el-table--fit容器
+        table_container = inner_aside_container.find_element(By.CSS_SELECTOR,
+                                                             "div.el-table--fit")
+        # 在表格容器中查找表格主体
+        table = table_container.find_element(By.CSS_SELECTOR,
+                                             "table.el-table__body")
+        # 获取所有行
+        rows = table.find_elements(By.CSS_SELECTOR, "tbody tr")
+        data_list = []
+        # 遍历每一行提取数据
+        for row in rows:
+            # 获取所有单元格
+            cells = row.find_elements(By.CSS_SELECTOR, "td")
+            if len(cells) >= 5:  # 确保有足够的列
+                # 依次为：区间、基金收益、业绩比较基准、超额收益(几何)、同类平均
+                data_list.append(build_stage_return_row([
+                    cells[0].find_element(By.CSS_SELECTOR, ".cell").text,
+                    cells[1].find_element(By.CSS_SELECTOR, "div").text,
+                    cells[2].find_element(By.CSS_SELECTOR, "div").text,
+                    cells[3].find_element(By.CSS_SELECTOR, "div").text,
+                    cells[4].find_element(By.CSS_SELECTOR, "div").text,
+                ]))
+        return data_list
+
+    def extract_data(self, fund_code, fund_data_file_path="fund_data.json", use_js_batch=True):
         """
         提取基金数据（回撤数据和区间收益数据）
         :param fund_code: 基金代码
         :param fund_data_file_path: 基金数据文件路径
+        :param use_js_batch: 是否通过一次JavaScript调用读取两个表格，失败时自动回退到逐个单元格读取
         """
         try:
             time.sleep(2)
@@ -313,13 +638,11 @@ class SimuwangBrowser:
             print(f"当前页面URL: {self.driver.current_url}")
             # 获取动态回撤数据
             table = WebDriverWait(self.driver, 30).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR,
-                                                "div.el-table--fit.el-table--enable-row-hover.el-table--enable-row-transition.el-table.el-table--layout-fixed.mt-16.header-blue.is-scrolling-none"))
+                EC.presence_of_element_located((By.CSS_SELECTOR, DRAWDOWN_TABLE_SELECTOR))
             )
-            drawdown_data = parse_drawdown_data(driver=self.driver)
-            print("提取的回撤数据:")
-            for period, value in drawdown_data.items():
-                print(f"  {period}: {value}")
+            drawdown_data = None
+            if not use_js_batch:
+                drawdown_data = parse_drawdown_data(driver=self.driver)
             # 获取区间收益
             interval_return_tab = WebDriverWait(self.driver, 10).until(
                 EC.element_to_be_clickable((By.XPATH,
@@ -347,68 +670,27 @@ class SimuwangBrowser:
                 EC.presence_of_element_located(
                     (By.CSS_SELECTOR, "aside[data-v-246b1dcb]"))
             )
-            # 在外部容器同级查找下一个aside容器
-            inner_aside_container = outer_container.find_element(By.XPATH,
-                                                                 "./following-sibling::aside")
-            # 在内部aside容器中查找div.el-table--fit容器
-            table_container = inner_aside_container.find_element(By.CSS_SELECTOR,
-                                                                 "div.el-table--fit")
-            # 在表格容器中查找表格主体
-            table = table_container.find_element(By.CSS_SELECTOR,
-                                                 "table.el-table__body")
-            # 获取所有行
-            rows = table.find_elements(By.CSS_SELECTOR, "tbody tr")
-            print(f"找到 {len(rows)} 行数据")
-            data_list = []
-            # 遍历每一行提取数据
-            for i, row in enumerate(rows):
-                # 获取所有单元格
-                cells = row.find_elements(By.CSS_SELECTOR, "td")
-                if len(cells) >= 5:  # 确保有足够的列
-                    # 提取区间
-                    interval = cells[0].find_element(By.CSS_SELECTOR, ".cell").text
-                    # 提取基金收益
-                    fund_return_element = cells[1].find_element(By.CSS_SELECTOR,
-                                                                "div")
-                    fund_return = fund_return_element.text
-                    # 提取业绩比较基准
-                    benchmark_element = cells[2].find_element(By.CSS_SELECTOR,
-                                                              "div")
-                    benchmark = benchmark_element.text
-                    # 提取超额收益(几何)
-                    excess_return_element = cells[3].find_element(By.CSS_SELECTOR,
-                                                                  "div")
-                    excess_return = excess_return_element.text
-                    # 提取同类平均
-                    average_element = cells[4].find_element(By.CSS_SELECTOR, "div")
-                    average = average_element.text
-
-                    # 构造数据字典
-                    data_row = {
-                        "区间": interval,
-                        "基金收益": {
-                            "百分比": fund_return,
-                        },
-                        "业绩比较基准": {
-                            "百分比": benchmark,
-                        },
-                        "超额收益(几何)": {
-                            "百分比": excess_return,
-                        },
-                        "同类平均": {
-                            "百分比": average,
-                        }
-                    }
-                    # 添加到列表
-                    data_list.append(data_row)
-                    # 打印提取的数据
-                    print(f"第{i + 1}行数据:")
-                    print(f"  区间: {interval}")
-                    print(f"  基金收益: {fund_return}")
-                    print(f"  业绩比较基准: {benchmark} ")
-                    print(f"  超额收益(几何): {excess_return}")
-                    print(f"  同类平均: {average} ")
-                    print("-" * 50)
+            data_list = None
+            if use_js_batch:
+                js_drawdown_data, data_list = self._extract_tables_by_js(table)
+                drawdown_data = drawdown_data or js_drawdown_data
+            if not drawdown_data:
+                drawdown_data = parse_drawdown_data(driver=self.driver)
+            if data_list is None:
+                data_list = self._extract_stage_rows(outer_container)
+            print("提取的回撤数据:")
+            for period, value in drawdown_data.items():
+                print(f"  {period}: {value}")
+            print(f"找到 {len(data_list)} 行数据")
+            # 打印提取的数据
+            for i, data_row in enumerate(data_list):
+                print(f"第{i + 1}行数据:")
+                print(f"  区间: {data_row['区间']}")
+                print(f"  基金收益: {data_row['基金收益']['百分比']}")
+                print(f"  业绩比较基准: {data_row['业绩比较基准']['百分比']} ")
+                print(f"  超额收益(几何): {data_row['超额收益(几何)']['百分比']}")
+                print(f"  同类平均: {data_row['同类平均']['百分比']} ")
+                print("-" * 50)
             # 将数据保存到JSON文件
             if data_list:
                 # 创建一个包含所有基金数据的字典
@@ -431,9 +713,11 @@ class SimuwangBrowser:
                 all_fund_data[fund_code]["区间收益"] = data_list
                 all_fund_data[fund_code]["回撤数据"] = drawdown_data
                 
-                # 保存所有基金数据到指定文件中
-                with open(fund_data_file_path, 'w', encoding='utf-8') as f:
+                # 保存所有基金数据到指定文件中（先写临时文件再替换，其他阶段同时读取时不会读到写了一半的文件）
+                tmp_path = fund_data_file_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
                     json.dump(all_fund_data, f, ensure_ascii=False, indent=4)
+                os.replace(tmp_path, fund_data_file_path)
                 print(f"数据已保存到 {fund_data_file_path}")
             return True
         except Exception as e:
@@ -450,14 +734,14 @@ class SimuwangBrowser:
             self.driver.quit()
 
 
-def simuwang(code, fund_data_file_path="fund_data.json"):
+def simuwang(code, fund_data_file_path="fund_data.json", max_tabs=4):
     browser = SimuwangBrowser()
     try:
         # 打开网站
         if not browser.open_simuwang():
             return
-        # 登录
-        if not browser.login():
+        # 登录（优先复用已保存的登录会话）
+        if not browser.ensure_login():
             return
 
         # 支持查询单只或多只基金
@@ -470,17 +754,25 @@ def simuwang(code, fund_data_file_path="fund_data.json"):
             print("无效的基金代码格式")
             return
 
+        # 已缓存详情页URL的基金直接多标签页并行打开，其余基金走搜索流程
+        cached_codes = [c for c in fund_codes if c in browser.fund_urls]
+        search_codes = [c for c in fund_codes if c not in browser.fund_urls]
+        if cached_codes:
+            print(f"{len(cached_codes)} 只基金已缓存详情页URL，使用 {max_tabs} 个标签页直接访问")
+            search_codes.extend(browser.extract_in_tabs(cached_codes, fund_data_file_path, max_tabs=max_tabs))
+
         # 遍历查询每只基金
-        for fund_code in fund_codes:
+        for fund_code in search_codes:
             print(f"\n开始查询基金: {fund_code}")
             # 搜索基金
             if not browser.search_fund(fund_code):
                 print(f"查询基金 {fund_code} 失败")
                 continue
-            # 提取数据，并传递基金数据文件路径
-            browser.extract_data(fund_code, fund_data_file_path)
+            # 提取数据，并传递基金数据文件路径；成功后缓存详情页URL
+            if browser.extract_data(fund_code, fund_data_file_path):
+                browser.remember_fund_url(fund_code)
             # 在查询下一只基金前等待一段时间
-            if fund_code != fund_codes[-1]:
+            if fund_code != search_codes[-1]:
                 print(f"等待5秒后查询下一只基金...")
                 time.sleep(5)
     except Exception as e:
@@ -0,0 +1,101 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class Stage:
+    """流水线中的一个阶段
+
+    func 以 inputs 中各项数据为关键字参数调用，返回值按 outputs 的顺序写入上下文
+    （只有一个输出时直接返回该值，多个输出时返回元组）。
+    after 中的阶段只用于约束执行顺序（如先后写入同一文件），不传递数据：
+    这些阶段结束（无论成功、失败还是被跳过）之后才执行本阶段。
+    pool 为执行该阶段的线程池名称，如浏览器阶段和HTTP阶段使用不同的线程池。
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), after=(), pool='http'):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.after = tuple(after)
+        self.pool = pool
+
+
+def run_stages(stages, pools, context=None, failed=None):
+    """按依赖关系并发执行各阶段：输入数据都已就绪且前置阶段已完成的阶段立即提交到对应线程池
+
+    Args:
+        stages (list): Stage 列表
+        pools (dict): 线程池名称 -> 最大线程数，如 {'browser': 1, 'http': 4}
+        context (dict, optional): 初始数据
+        failed (set, optional): 传入时把失败或被跳过的阶段名称加入其中
+
+    Returns:
+        dict: 所有阶段输出的数据（失败或被跳过的阶段没有输出）
+    """
+    context = dict(context or {})
+    names = {stage.name for stage in stages}
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    for stage in stages:
+        for item in stage.inputs:
+            if item not in producers and item not in context:
+                raise ValueError(f"阶段 {stage.name} 的输入 {item} 没有对应的来源")
+        for name in stage.after:
+            if name not in names:
+                raise ValueError(f"阶段 {stage.name} 依赖的阶段 {name} 不存在")
+        if stage.pool not in pools:
+            raise ValueError(f"阶段 {stage.name} 的线程池 {stage.pool} 不存在")
+
+    executors = {name: ThreadPoolExecutor(max_workers=max_workers) for name, max_workers in pools.items()}
+    pending = list(stages)
+    running = {}
+    done = set()
+    failed = set() if failed is None else failed
+
+    def data_blockers(stage):
+        return [producers[item] for item in stage.inputs if item not in context]
+
+    try:
+        while pending or running:
+            # 跳过输入数据来自失败阶段的阶段（after 中的阶段失败不影响）
+            for stage in list(pending):
+                if any(name in failed for name in data_blockers(stage)):
+                    print(f"[{stage.name}] 依赖的阶段失败，跳过")
+                    pending.remove(stage)
+                    failed.add(stage.name)
+
+            # 提交已就绪的阶段
+            for stage in list(pending):
+                if all(name in done for name in data_blockers(stage)) and \
+                        all(name in done or name in failed for name in stage.after):
+                    pending.remove(stage)
+                    kwargs = {item: context[item] for item in stage.inputs}
+                    print(f"[{stage.name}] 开始执行")
+                    running[executors[stage.pool].submit(stage.func, **kwargs)] = (stage, time.time())
+
+            if not running:
+                for stage in pending:
+                    print(f"[{stage.name}] 依赖无法满足，跳过")
+                    failed.add(stage.name)
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, start_time = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"[{stage.name}] 执行失败: {e}")
+                    failed.add(stage.name)
+                    continue
+                if len(stage.outputs) == 1:
+                    context[stage.outputs[0]] = result
+                elif stage.outputs:
+                    context.update(zip(stage.outputs, result))
+                done.add(stage.name)
+                print(f"[{stage.name}] 完成，耗时 {time.time() - start_time:.1f} 秒")
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+    return context
@@ -0,0 +1,177 @@
+import json
+import os
+from datetime import datetime, date, timedelta
+from threading import Lock
+
+# 本地交易日历文件（日期字符串列表），缺失或过期时用akshare刷新
+TRADE_CALENDAR_FILE = 'trade_calendar.json'
+
+# 各定时任务最近一次处理的数据日期
+JOB_STATE_FILE = 'job_state.json'
+
+# 季报/半年报/年报的披露月份：1月（四季度报）、3-4月（年报、一季报）、7-8月（二季度报、半年报）、10月（三季度报）
+DISCLOSURE_MONTHS = {1, 3, 4, 7, 8, 10}
+
+# 披露期内季度数据（规模、持有人结构、持仓等）的刷新间隔（天）
+QUARTERLY_REFRESH_DAYS = 7
+
+_calendar = None
+_calendar_lock = Lock()
+_state_lock = Lock()
+
+
+def to_date(value=None):
+    """把 None/datetime/date/'YYYY-MM-DD' 统一转换为date，None表示今天"""
+    if value is None:
+        return datetime.now().date()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def refresh_trade_calendar():
+    """从akshare（新浪）获取交易日历并保存到本地，失败时返回None"""
+    try:
+        import akshare as ak
+        calendar_df = ak.tool_trade_date_hist_sina()
+        trade_dates = sorted(str(d)[:10] for d in calendar_df['trade_date'])
+        with open(TRADE_CALENDAR_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'更新时间': datetime.now().strftime('%Y-%m-%d'), '交易日': trade_dates},
+                      f, ensure_ascii=False)
+        print(f"交易日历已更新，共 {len(trade_dates)} 个交易日")
+        return trade_dates
+    except Exception as e:
+        print(f"获取交易日历失败: {e}")
+        return None
+
+
+def load_trade_calendar():
+    """
+    加载交易日历（进程内只加载一次）
+    本地文件不存在或已不覆盖今天时尝试刷新（每天最多一次），都失败时返回空集合（按工作日判断）
+    """
+    global _calendar
+    today = datetime.now().date()
+    with _calendar_lock:
+        if _calendar is not None and (_calendar['covers_today'] or _calendar['checked'] == today):
+            return _calendar['dates']
+
+        trade_dates = []
+        updated = None
+        if os.path.exists(TRADE_CALENDAR_FILE):
+            try:
+                with open(TRADE_CALENDAR_FILE, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                trade_dates = data.get('交易日', [])
+                updated = data.get('更新时间')
+            except Exception as e:
+                print(f"读取交易日历失败: {e}")
+
+        covers_today = bool(trade_dates) and trade_dates[-1] >= today.strftime('%Y-%m-%d')
+        if not covers_today and updated != today.strftime('%Y-%m-%d'):
+            refreshed = refresh_trade_calendar()
+            if refreshed:
+                trade_dates = refreshed
+                covers_today = trade_dates[-1] >= today.strftime('%Y-%m-%d')
+
+        _calendar = {
+            'dates': {to_date(d) for d in trade_dates},
+            'covers_today': covers_today,
+            'checked': today,
+        }
+        return _calendar['dates']
+
+
+def is_trading_day(day=None):
+    """是否为交易日；没有交易日历时按周一至周五判断"""
+    day = to_date(day)
+    trade_dates = load_trade_calendar()
+    if trade_dates and min(trade_dates) <= day <= max(trade_dates):
+        return day in trade_dates
+    return day.weekday() < 5
+
+
+def last_trading_day(before=None):
+    """早于指定日期（默认今天）的最近一个交易日，即当前可获取到的最新净值/排名数据的日期"""
+    day = to_date(before) - timedelta(days=1)
+    for _ in range(366):
+        if is_trading_day(day):
+            return day
+        day -= timedelta(days=1)
+    return day
+
+
+def load_job_state():
+    """读取各任务最近一次处理的数据日期"""
+    if not os.path.exists(JOB_STATE_FILE):
+        return {}
+    try:
+        with open(JOB_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取任务状态失败: {e}")
+        return {}
+
+
+def should_run(job_name, now=None):
+    """上一个交易日的数据是否还没有被该任务处理过（周末、节假日和重启时不重复执行）"""
+    data_date = last_trading_day(now).strftime('%Y-%m-%d')
+    with _state_lock:
+        return load_job_state().get(job_name) != data_date
+
+
+def mark_run(job_name, now=None):
+    """记录任务已处理上一个交易日的数据"""
+    data_date = last_trading_day(now).strftime('%Y-%m-%d')
+    with _state_lock:
+        state = load_job_state()
+        state[job_name] = data_date
+        with open(JOB_STATE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def run_if_new_trading_data(job_name, func, *args, **kwargs):
+    """
+    有新的交易日数据时才执行任务，任务返回True（成功）时才记录；返回任务是否执行成功
+    任务失败或只完成一部分时不记录，重启或下次检查时会重新执行
+    """
+    if not should_run(job_name):
+        print(f"[{job_name}] 上一个交易日（{last_trading_day()}）的数据已处理，跳过本次执行")
+        return False
+    if not func(*args, **kwargs):
+        print(f"[{job_name}] 本次执行未成功完成，不记录，下次检查时重新执行")
+        return False
+    mark_run(job_name)
+    return True
+
+
+def in_disclosure_window(day=None):
+    """是否处于定期报告披露期"""
+    return to_date(day).month in DISCLOSURE_MONTHS
+
+
+def next_disclosure_day(day):
+    """从指定日期起（含）的第一个披露期日期"""
+    day = to_date(day)
+    for _ in range(13):
+        if day.month in DISCLOSURE_MONTHS:
+            return day
+        day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return day
+
+
+def is_quarterly_data_stale(update_date, today=None, refresh_days=QUARTERLY_REFRESH_DAYS):
+    """
+    季度披露数据是否需要刷新：
+    上次更新refresh_days天之后，只要经过了披露期中的任意一天就需要刷新；
+    即披露期内每refresh_days天刷新一次，披露期外不刷新
+    """
+    if not update_date:
+        return True
+    try:
+        update_date = to_date(update_date)
+    except ValueError:
+        return True
+    return next_disclosure_day(update_date + timedelta(days=refresh_days)) <= to_date(today)